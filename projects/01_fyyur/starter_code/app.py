@@ -3,10 +3,11 @@
 #----------------------------------------------------------------------------#
 
 import json
+import click
 import dateutil.parser
 import babel
 import datetime
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, jsonify
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 import logging
@@ -15,6 +16,9 @@ from flask_wtf import Form
 from forms import *
 from flask_migrate import Migrate
 from dateutil import parser
+from datetime import timedelta
+from itertools import groupby
+from search import EntitySearch
 
 
 #----------------------------------------------------------------------------#
@@ -35,6 +39,26 @@ migrate = Migrate(app, db)
 #----------------------------------------------------------------------------#
 
 
+venue_genres = db.Table('venue_genres',
+    db.Column('venue_id', db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id', ondelete='CASCADE'), primary_key=True),
+    # genre facet: venues of a genre
+    db.Index('ix_venue_genres_genre_id', 'genre_id', 'venue_id')
+)
+
+artist_genres = db.Table('artist_genres',
+    db.Column('artist_id', db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id', ondelete='CASCADE'), primary_key=True),
+    # genre facet: artists of a genre
+    db.Index('ix_artist_genres_genre_id', 'genre_id', 'artist_id')
+)
+
+class Genre(db.Model):
+    __tablename__ = 'genres'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
 class Venue(db.Model):
     __tablename__ = 'venues'
 
@@ -46,7 +70,10 @@ class Venue(db.Model):
     phone = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    genres = db.relationship('Genre', secondary=venue_genres, order_by='Genre.name')
+    # maintained counters, see the Show counters section
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     show = db.relationship('Show', backref='Venue', lazy=True)
     
     
@@ -61,10 +88,18 @@ class Artist(db.Model):
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    genres = db.relationship('Genre', secondary=artist_genres, order_by='Genre.name')
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
+    # maintained counters, see the Show counters section
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     show = db.relationship('Show', backref='Artist', lazy=True)
+
+    __table_args__ = (
+        # state facet of the artists listing
+        db.Index('ix_artists_state', 'state'),
+    )
     
 class Show(db.Model):
     __tablename__ = 'shows'
@@ -74,14 +109,31 @@ class Show(db.Model):
     
     artist_id = db.Column(db.Integer, db.ForeignKey('artists.id'), nullable=False)
     
+    __table_args__ = (
+        # upcoming/past shows of a venue or an artist
+        db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+        # /shows listing, ordered by start time
+        db.Index('ix_shows_start_time', 'start_time'),
+    )
 
     
 
     
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
+class ShowCountsWatermark(db.Model):
+    # single row: the counters count the shows starting after rolled_over_at
+    # as upcoming and the others as past
+    __tablename__ = 'show_counts_watermark'
+    id = db.Column(db.Integer, primary_key=True)
+    rolled_over_at = db.Column(db.DateTime, nullable=False)
+
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 
+venue_search = EntitySearch(db, Venue)
+artist_search = EntitySearch(db, Artist)
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
@@ -110,113 +162,117 @@ def index():
 
 @app.route('/venues')
 def venues():
+  # one query for every venue with its maintained number of upcoming shows,
+  # ordered by area so the venues of a city are adjacent and grouped in a
+  # single pass
+  rows = db.session.query(
+      Venue.id, Venue.name, Venue.city, Venue.state,
+      Venue.upcoming_shows_count.label('num_upcoming_shows')
+    ).order_by(Venue.state, Venue.city, Venue.id) \
+    .all()
+
   data = []
-  locations = set()
-  venues = Venue.query.all()
-  for venue in venues:
-    locations.add((venue.city, venue.state))
-  for location in locations:
+  for (city, state), venues in groupby(rows, key=lambda row: (row.city, row.state)):
     data.append({
-      "city": location[0],
-      "state": location[1],
-      "venues": []
+      "city": city,
+      "state": state,
+      "venues": [{
+        "id": venue.id,
+        "name": venue.name,
+        "num_upcoming_shows": venue.num_upcoming_shows
+      } for venue in venues]
     })
-  for venue in venues:
-    num_upcoming_shows = 0
-    shows = Show.query.filter_by(venue_id=venue.id).all()
-    now = datetime.now()
-    for show in shows:
-      if show.start_time > now:
-        num_upcoming_shows += 1
-    for location in data:
-      if venue.state == location['state'] and venue.city == location['city']:
-        location['venues'].append({
-            "id": venue.id,
-            "name": venue.name,
-            "num_upcoming_shows": num_upcoming_shows
-        })
   return render_template('pages/venues.html', areas=data)
 
+SEARCH_PER_PAGE = 20
+
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
+  # case-insensitive partial search on the name, city and state of venues
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  search_term = request.form.get('search_term','')
-  result = Venue.query.filter(Venue.name.ilike(f'{search_term}%'))
+  return search_page(venue_search, 'pages/search_venues.html')
+
+def search_page(search, template):
+  search_term = request.form.get('search_term', '')
+  page = max(request.form.get('page', 1, type=int), 1)
+  total, data = search.search(search_term, page, SEARCH_PER_PAGE)
   response = {
-    "count": result.count(),
-    "data": result
+    "count": total,
+    "data": data,
+    "page": page,
+    "prev_page": page - 1 if page > 1 else None,
+    "next_page": page + 1 if page * SEARCH_PER_PAGE < total else None
   }
-
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+  return render_template(template, results=response, search_term=search_term)
 
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
-  # TODO: replace with real venue data from the venues table, using venue_id
-  venue = Venue.query.filter_by(id=venue_id).first()
-  upcoming_show = db.session.query(Show).join(Artist).filter(Show.venue_id==venue_id).all()
-  past_show = db.session.query(Show).join(Artist).filter(Show.venue_id==venue_id).all()
-
-    # get all shows for given venue
-  
-
-    # returns upcoming shows
-  def upcoming_shows():
-    upcoming = []
-    
-    
-
-        # if show is in future, add show details to upcoming
-    for show in upcoming_show:
-      if show.start_time > datetime.now():
-        upcoming.append({
-          "artist_id": show.artist_id,
-          "artist_name": Artist.query.filter_by(id=show.artist_id).first().name,
-          "artist_image_link": Artist.query.filter_by(id=show.artist_id).first().image_link,
-          "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M")
-       
-        })
-    return upcoming
-
-    # returns past shows
-  def past_shows():
-    
-    past = []
-
-        # if show is in past, add show details to past
-    for show in past_show :
-      if show.start_time < datetime.now():
-        past.append({
-          "artist_id": show.artist_id,
-          "artist_name": Artist.query.filter_by(id=show.artist_id).first().name,
-          "artist_image_link": Artist.query.filter_by(id=show.artist_id).first().image_link,
-          "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M")
-        })  
-      
-    return past
-
-    # data for given venue
+  venue, shows = load_with_shows(Venue, venue_id)
   data = {
     "id": venue.id,
     "name": venue.name,
-    "genres": venue.genres,
+    "genres": [genre.name for genre in venue.genres],
     "address": venue.address,
     "city": venue.city,
     "state": venue.state,
     "phone": venue.phone,
     "facebook_link": venue.facebook_link,
     "image_link": venue.image_link,
-    "past_shows": past_shows(),
-    "upcoming_shows": upcoming_shows(),
-    "past_shows_count": len(past_shows()),
-    "upcoming_shows_count": len(upcoming_shows())
+    **shows
   }
-
-    # return template with venue data
   return render_template('pages/show_venue.html', venue=data)
 
+def load_with_shows(model, model_id):
+  # loads a venue or an artist with its shows, each joined with the artist
+  # or venue on the other side, in one query. The query splits the shows
+  # into upcoming and past and returns the size of each part on its rows.
+  # returns (venue or artist, dict of past/upcoming shows and counts)
+  if model is Venue:
+    other, prefix = Artist, 'artist'
+    own_id, other_id = Show.venue_id, Show.artist_id
+  else:
+    other, prefix = Venue, 'venue'
+    own_id, other_id = Show.artist_id, Show.venue_id
+
+  upcoming = Show.start_time > datetime.now()
+  rows = db.session.query(
+      model,
+      Show.start_time,
+      other.id.label('other_id'),
+      other.name.label('other_name'),
+      other.image_link.label('other_image_link'),
+      upcoming.label('upcoming'),
+      db.func.count(Show.id).over(partition_by=upcoming).label('shows_count')
+    ).outerjoin(Show, own_id == model.id) \
+    .outerjoin(other, other.id == other_id) \
+    .filter(model.id == model_id) \
+    .order_by(Show.start_time) \
+    .all()
+  if not rows:
+    abort(404)
+
+  shows = {
+    "past_shows": [],
+    "upcoming_shows": [],
+    "past_shows_count": 0,
+    "upcoming_shows_count": 0
+  }
+  for row in rows:
+    # a venue or artist without shows comes back as one row without a show
+    if row.start_time is None:
+      continue
+    when = 'upcoming' if row.upcoming else 'past'
+    shows[when + '_shows'].append({
+      prefix + "_id": row.other_id,
+      prefix + "_name": row.other_name,
+      prefix + "_image_link": row.other_image_link,
+      "start_time": str(row.start_time)
+    })
+    shows[when + '_shows_count'] = row.shows_count
+  return rows[0][0], shows
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
@@ -231,7 +287,7 @@ def create_venue_submission():
   city = request.form.get('city')
   state = request.form.get('state')
   phone = request.form.get('phone')
-  genres = request.form.get('genres')
+  genres = get_genres(request.form.getlist('genres'))
   image_link = request.form.get('image_link')
   facebook_link = request.form.get('facebook_link')
   
@@ -273,54 +329,88 @@ def delete_venue(venue_id):
 #  ----------------------------------------------------------------
 @app.route('/artists')
 def artists():
-  # TODO: replace with real data returned from querying the database
-  data=[]
-  artist = Artist.query.all()
-  for a in artist:
-    data.append(a)
-  return render_template('pages/artists.html', artists=data)
+  # artists, optionally filtered by ?genre= and ?state=, with the number of
+  # artists for every genre and state. Each facet is counted with the other
+  # filter applied, so its counts tell what selecting a value would return.
+  genre = request.args.get('genre')
+  state = request.args.get('state')
+
+  def filtered(query, by_genre=True, by_state=True):
+    if genre and by_genre:
+      query = query.filter(Artist.id.in_(
+        db.session.query(artist_genres.c.artist_id)
+          .join(Genre, Genre.id == artist_genres.c.genre_id)
+          .filter(Genre.name == genre)))
+    if state and by_state:
+      query = query.filter(Artist.state == state)
+    return query
+
+  artists = filtered(db.session.query(Artist.id, Artist.name)) \
+    .order_by(Artist.name, Artist.id) \
+    .all()
+  genre_counts = filtered(
+      db.session.query(Genre.name, db.func.count(Artist.id))
+        .join(artist_genres, artist_genres.c.genre_id == Genre.id)
+        .join(Artist, Artist.id == artist_genres.c.artist_id),
+      by_genre=False) \
+    .group_by(Genre.name) \
+    .order_by(Genre.name) \
+    .all()
+  state_counts = filtered(
+      db.session.query(Artist.state, db.func.count(Artist.id)),
+      by_state=False) \
+    .filter(Artist.state.isnot(None)) \
+    .group_by(Artist.state) \
+    .order_by(Artist.state) \
+    .all()
 
+  data = {
+    "artists": [{"id": artist.id, "name": artist.name} for artist in artists],
+    "count": len(artists),
+    "filters": {"genre": genre, "state": state},
+    "facets": {
+      "genre": [{"value": name, "count": count} for name, count in genre_counts],
+      "state": [{"value": name, "count": count} for name, count in state_counts]
+    }
+  }
+  if request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json':
+    return jsonify(data)
+  return render_template('pages/artists.html', artists=data['artists'], browse=data)
+
+def get_genres(names):
+  # the Genre rows named in names, creating the missing ones
+  names = sorted({name.strip() for name in names or [] if name and name.strip()})
+  if not names:
+    return []
+  genres = {genre.name: genre for genre in Genre.query.filter(Genre.name.in_(names))}
+  for name in names:
+    if name not in genres:
+      genres[name] = Genre(name=name)
+      db.session.add(genres[name])
+  return [genres[name] for name in names]
 
 
 # Search artists
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
-  data = []
-  artists = []
-  search_term = request.form.get("search_term").lower()
-  for artist in db.session.query(Artist).with_entities(Artist.id, Artist.name).all():
-    if search_term in artist.name.lower():
-      artists.append(artist)
-  for artist in artists:
-        # Filter artist upcoming shows
-    upcoming_shows = Show.query.filter_by(artist_id=artist.id).filter(Show.start_time > datetime.utcnow().isoformat()).all()
-    
-    data.append({
-      "id": artist.id,
-      "name": artist.name,
-      "num_upcoming_shows": len(upcoming_shows)
-    })
-    response = {
-        "count": len(artists),
-        "data": data
-    }
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+  # case-insensitive partial search on the name, city and state of artists
+  return search_page(artist_search, 'pages/search_artists.html')
 
 @app.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
-  # shows the venue page with the given venue_id
-  # TODO: replace with real venue data from the venues table, using venue_id
-  artist = Artist.query.filter_by(id=artist_id).first()
-
-    # get all shows matching artist id
-  artist = Artist.query.get(artist_id)
-  now= datetime.datetime.utcnow()
-  artist.upcoming_shows_count = db.session.query(Artist).join(Show, Show.artist_id == Artist.id).filter(Show.artist_id == artist_id, Show.start_time > now).count()
-  artist.upcoming_shows = db.session.query(Artist).join(Show, Show.artist_id == Artist.id).filter(Show.artist_id == artist_id, Show.start_time > now).all()
-  artist.past_shows_count = db.session.query(Artist).join(Show, Show.artist_id == Artist.id).filter(Show.artist_id == artist_id, Show.start_time < now).count()
-  artist.past_shows = db.session.query(Artist).join(Show, Show.artist_id == Artist.id).filter(Show.artist_id == artist_id, Show.start_time > now).all()  
-
-    # return artist page with data
+  # shows the artist page with the given artist_id
+  artist, shows = load_with_shows(Artist, artist_id)
+  data = {
+    "id": artist.id,
+    "name": artist.name,
+    "genres": [genre.name for genre in artist.genres],
+    "city": artist.city,
+    "state": artist.state,
+    "phone": artist.phone,
+    "facebook_link": artist.facebook_link,
+    "image_link": artist.image_link,
+    **shows
+  }
   return render_template('pages/show_artist.html', artist=data)
 
 #  Update
@@ -334,7 +424,7 @@ def edit_artist(artist_id):
   form.state.data = artist.state
   form.phone.data = artist.phone
   form.seeking_description.data = artist.seeking_description
-  form.genres.data = artist.genres
+  form.genres.data = [genre.name for genre in artist.genres]
   form.facebook_link.data = artist.facebook_link
   form.website.data = artist.website
   # TODO: populate form with fields from artist with ID <artist_id>
@@ -354,7 +444,7 @@ def edit_artist_submission(artist_id):
       artist.seeking_description = form.seeking_description.data,
       artist.facebook_link = form.facebook_link.data,
       artist.website = form.website.data,
-      artist.genres = form.genres.data
+      artist.genres = get_genres(form.genres.data)
        # add to database
       db.session.add(artist)
       db.session.commit()
@@ -376,7 +466,7 @@ def edit_venue(venue_id):
   form.address.data = venue.address
   form.phone.data = venue.phone
   form.seeking_description.data = venue.seeking_description
-  form.genres.data = venue.genres
+  form.genres.data = [genre.name for genre in venue.genres]
   form.facebook_link.data = venue.facebook_link
   form.website.data = venue.website
   # TODO: populate form with values from venue with ID <venue_id>
@@ -396,7 +486,7 @@ def edit_venue_submission(venue_id):
       venue.image_link = form.image_link.data,
       venue.facebook_link = form.facebook_link.data,
       venue.website = form.website.data,
-      venue.genres = form.genres.data
+      venue.genres = get_genres(form.genres.data)
             # add to database
       db.session.add(venue)
       db.session.commit()
@@ -423,7 +513,7 @@ def create_artist_submission():
   city = request.form.get('city')
   state = request.form.get('state')
   phone = request.form.get('phone')
-  genres = request.form.get('genres')
+  genres = get_genres(request.form.getlist('genres'))
   image_link = request.form.get('image_link')
   facebook_link = request.form.get('facebook_link')
   artist = Artist(name = name, city = city, state = state, phone = phone, genres = genres, image_link = image_link, facebook_link = facebook_link)
@@ -444,27 +534,64 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
+SHOWS_PER_PAGE = 30
+
 @app.route('/shows')
 def shows():
-  # displays list of shows at /shows
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
-  shows = Show.query.all()
+  # displays list of shows at /shows, SHOWS_PER_PAGE at a time, ordered by
+  # start time; ?from= and ?to= keep the shows starting in [from, to)
+  page = request.args.get('page', 1, type=int)
+  if page < 1:
+    abort(404)
+  try:
+    date_from = parse_date_arg('from')
+    date_to = parse_date_arg('to')
+  except (ValueError, OverflowError):
+    abort(400)
+
+  # venue and artist come from the same query instead of a lookup per show
+  query = db.session.query(
+      Show.id, Show.start_time,
+      Show.venue_id, Venue.name.label('venue_name'),
+      Show.artist_id, Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link')
+    ).join(Venue, Venue.id == Show.venue_id) \
+    .join(Artist, Artist.id == Show.artist_id)
+  if date_from:
+    query = query.filter(Show.start_time >= date_from)
+  if date_to:
+    query = query.filter(Show.start_time < date_to)
+
+  # one extra row tells whether there is a next page without a COUNT
+  rows = query.order_by(Show.start_time, Show.id) \
+    .offset((page - 1) * SHOWS_PER_PAGE) \
+    .limit(SHOWS_PER_PAGE + 1) \
+    .all()
 
   data = []
-
-    # get venue and artist information for each show
-  for show in shows:
+  for row in rows[:SHOWS_PER_PAGE]:
     data.append({
-      "venue_id": show.venue_id,
-      "venue_name": Venue.query.filter_by(id=show.venue_id).first().name,
-      "artist_id": show.artist_id,
-      "artist_name": Artist.query.filter_by(id=show.artist_id).first().name,
-      "artist_image_link": Artist.query.filter_by(id=show.artist_id).first().image_link,
-      "start_time": datetime.strptime(str(show, show.start_time))
+      "venue_id": row.venue_id,
+      "venue_name": row.venue_name,
+      "artist_id": row.artist_id,
+      "artist_name": row.artist_name,
+      "artist_image_link": row.artist_image_link,
+      "start_time": str(row.start_time)
     })
-    data.append(show)
-  return render_template('pages/shows.html', shows=data)
+
+  filters = {key: request.args[key] for key in ('from', 'to') if request.args.get(key)}
+  pagination = {
+    "prev_url": url_for('shows', page=page - 1, **filters) if page > 1 else None,
+    "next_url": url_for('shows', page=page + 1, **filters) if len(rows) > SHOWS_PER_PAGE else None
+  }
+  return render_template('pages/shows.html', shows=data, pagination=pagination)
+
+def parse_date_arg(name):
+  # a date or datetime query string argument, None when it is missing
+  value = request.args.get(name)
+  if not value:
+    return None
+  return parser.parse(value)
 
 @app.route('/shows/create')
 def create_shows():
@@ -478,20 +605,19 @@ def create_show_submission():
   # TODO: insert form data as a new Show record in the db, instead
   try:
         # get user input data from form
-    artist_id = request.form['artist_id']
-    venue_id = request.form['venue_id']
-    start_time = request.form['start_time']
-
-        # create new show with user data
-    show = Show(artist_id=artist_id, venue_id=venue_id,start_time=start_time)
+    artist_id = int(request.form['artist_id'])
+    venue_id = int(request.form['venue_id'])
+    start_time = parser.parse(request.form['start_time'])
 
-                    
-        # add show and commit session
-    db.session.add(show)
+        # book the show, checking the venue and the artist are free
+    book_show(venue_id, artist_id, start_time)
     db.session.commit()
 
         # on successful db insert, flash success
     flash('Show was successfully listed!')
+  except BookingConflict as conflict:
+      db.session.rollback()
+      flash('Show could not be listed: ' + str(conflict))
   except:
         # rollback if exception
       db.session.rollback()
@@ -499,14 +625,171 @@ def create_show_submission():
       flash('An error occurred. Show could not be listed.')
   finally:
     db.session.close()
-  
-  # on successful db insert, flash success
-  flash('Show was successfully listed!')
-  # TODO: on unsuccessful db insert, flash an error instead.
-  # e.g., flash('An error occurred. Show could not be listed.')
-  # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   return render_template('pages/home.html')
 
+#  Booking
+#  ----------------------------------------------------------------
+#  Every show is taken to last SHOW_DURATION, so two shows overlap when
+#  their start times are less than SHOW_DURATION apart. Conflicts are found
+#  with a range scan of the (venue_id, start_time) and (artist_id,
+#  start_time) indexes on shows, O(log n) per booking.
+
+class BookingConflict(Exception):
+  pass
+
+def book_show(venue_id, artist_id, start_time):
+  # adds a show to the current transaction, raises BookingConflict when the
+  # venue or the artist is already booked at that time
+  # lock order: watermark, venue, artist, the one roll-overs also follow
+  show_counts_watermark(lock=True)
+  # the locks make concurrent bookings of the same venue or artist wait for
+  # each other, so both cannot pass the check below
+  venue = Venue.query.filter_by(id=venue_id).with_for_update().first()
+  artist = Artist.query.filter_by(id=artist_id).with_for_update().first()
+  if venue is None:
+    raise BookingConflict('there is no venue {}.'.format(venue_id))
+  if artist is None:
+    raise BookingConflict('there is no artist {}.'.format(artist_id))
+
+  duration = app.config['SHOW_DURATION']
+  for key, key_id, name in ((Show.venue_id, venue_id, venue.name), (Show.artist_id, artist_id, artist.name)):
+    clash = db.session.query(Show.start_time) \
+      .filter(key == key_id) \
+      .filter(Show.start_time > start_time - duration, Show.start_time < start_time + duration) \
+      .order_by(Show.start_time) \
+      .first()
+    if clash is not None:
+      raise BookingConflict('{} is already booked for a show at {}.'.format(name, clash.start_time))
+
+  show = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time)
+  db.session.add(show)
+  count_new_show(show)
+  return show
+
+AVAILABILITY_MAX_DAYS = 92
+
+@app.route('/venues/<int:venue_id>/availability')
+def venue_availability(venue_id):
+  # booked and free time of a venue in [from, to), by default the next week
+  if Venue.query.filter_by(id=venue_id).with_entities(Venue.id).first() is None:
+    abort(404)
+  try:
+    date_from = parse_date_arg('from') or datetime.now()
+    date_to = parse_date_arg('to') or date_from + timedelta(days=7)
+  except (ValueError, OverflowError):
+    abort(400)
+  if date_to <= date_from or date_to - date_from > timedelta(days=AVAILABILITY_MAX_DAYS):
+    abort(400)
+
+  duration = app.config['SHOW_DURATION']
+  # shows that started before date_from may still be running
+  shows = db.session.query(Show.start_time, Show.artist_id) \
+    .filter(Show.venue_id == venue_id) \
+    .filter(Show.start_time > date_from - duration, Show.start_time < date_to) \
+    .order_by(Show.start_time) \
+    .all()
+
+  booked = []
+  free = []
+  free_from = date_from
+  for show in shows:
+    end_time = show.start_time + duration
+    booked.append({
+      "artist_id": show.artist_id,
+      "start_time": show.start_time.isoformat(),
+      "end_time": end_time.isoformat()
+    })
+    if show.start_time > free_from:
+      free.append({"start": free_from.isoformat(), "end": show.start_time.isoformat()})
+    free_from = max(free_from, end_time)
+  if free_from < date_to:
+    free.append({"start": free_from.isoformat(), "end": date_to.isoformat()})
+
+  return jsonify({
+    "venue_id": venue_id,
+    "from": date_from.isoformat(),
+    "to": date_to.isoformat(),
+    "show_duration_minutes": int(duration.total_seconds() // 60),
+    "booked": booked,
+    "free": free
+  })
+
+#  Show counters
+#  ----------------------------------------------------------------
+#  Venue and Artist keep upcoming_shows_count and past_shows_count so the
+#  listing pages never count shows. A show starting after the watermark
+#  counts as upcoming; the roll-over-shows command, run on a schedule (cron,
+#  every few minutes), moves the shows that started since its last run to
+#  past and advances the watermark.
+
+def show_counts_watermark(lock=False):
+  query = ShowCountsWatermark.query.filter_by(id=1)
+  if lock:
+    # serializes roll-overs and show creation against each other
+    query = query.with_for_update()
+  watermark = query.first()
+  if watermark is None:
+    watermark = ShowCountsWatermark(id=1, rolled_over_at=datetime.now())
+    db.session.add(watermark)
+  return watermark
+
+def count_new_show(show):
+  # counts a show being created in the current transaction
+  watermark = show_counts_watermark(lock=True)
+  upcoming = show.start_time > watermark.rolled_over_at
+  for model, model_id in ((Venue, show.venue_id), (Artist, show.artist_id)):
+    column = model.upcoming_shows_count if upcoming else model.past_shows_count
+    db.session.query(model).filter(model.id == model_id) \
+      .update({column: column + 1}, synchronize_session=False)
+
+def roll_over_show_counts(now=None):
+  # moves the shows that started since the watermark from upcoming to past,
+  # returns the number of shows moved
+  now = now or datetime.now()
+  watermark = show_counts_watermark(lock=True)
+  since = watermark.rolled_over_at
+  moved = 0
+  if now > since:
+    for model, key in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+      started = db.session.query(key, db.func.count(Show.id)) \
+        .filter(Show.start_time > since, Show.start_time <= now) \
+        .group_by(key) \
+        .all()
+      for model_id, count in started:
+        db.session.query(model).filter(model.id == model_id).update({
+          model.upcoming_shows_count: model.upcoming_shows_count - count,
+          model.past_shows_count: model.past_shows_count + count
+        }, synchronize_session=False)
+        if model is Venue:
+          # every show has one venue, count it once
+          moved += count
+    watermark.rolled_over_at = now
+  db.session.commit()
+  return moved
+
+def recount_show_counts(now=None):
+  # recomputes every counter from the shows table
+  now = now or datetime.now()
+  watermark = show_counts_watermark(lock=True)
+  for model, key in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+    shows = db.session.query(db.func.count(Show.id)).filter(key == model.id)
+    db.session.query(model).update({
+      model.upcoming_shows_count: shows.filter(Show.start_time > now).as_scalar(),
+      model.past_shows_count: shows.filter(Show.start_time <= now).as_scalar()
+    }, synchronize_session=False)
+  watermark.rolled_over_at = now
+  db.session.commit()
+
+@app.cli.command('roll-over-shows')
+@click.option('--recount', is_flag=True, help='Recompute every counter from the shows table.')
+def roll_over_shows_command(recount):
+  """Moves started shows from the upcoming to the past counters."""
+  if recount:
+    recount_show_counts()
+    click.echo('Recounted the shows of every venue and artist.')
+  else:
+    click.echo('Moved {} shows to past.'.format(roll_over_show_counts()))
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
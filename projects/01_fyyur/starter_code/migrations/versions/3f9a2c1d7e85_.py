@@ -0,0 +1,24 @@
+"""index shows by venue and start time
+
+Revision ID: 3f9a2c1d7e85
+Revises: b7ab20a159f1
+Create Date: 2026-10-18 20:05:12.418337
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a2c1d7e85'
+down_revision = 'b7ab20a159f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_shows_venue_id_start_time', 'shows', ['venue_id', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_shows_venue_id_start_time', table_name='shows')
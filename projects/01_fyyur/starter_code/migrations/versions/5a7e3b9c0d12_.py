@@ -0,0 +1,36 @@
+"""trigram indexes for venue and artist search
+
+Revision ID: 5a7e3b9c0d12
+Revises: d25e7b93f4c1
+Create Date: 2026-10-18 20:55:47.603918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a7e3b9c0d12'
+down_revision = 'd25e7b93f4c1'
+branch_labels = None
+depends_on = None
+
+
+# the location expression must stay the one EntitySearch.location() builds
+INDEXES = [
+    ('ix_venues_name_trgm', 'venues', 'name'),
+    ('ix_venues_location_trgm', 'venues', "(city || ', ' || state)"),
+    ('ix_artists_name_trgm', 'artists', 'name'),
+    ('ix_artists_location_trgm', 'artists', "(city || ', ' || state)"),
+]
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, expression in INDEXES:
+        op.execute('CREATE INDEX {} ON {} USING gin ({} gin_trgm_ops)'.format(name, table, expression))
+
+
+def downgrade():
+    for name, table, expression in INDEXES:
+        op.drop_index(name, table_name=table)
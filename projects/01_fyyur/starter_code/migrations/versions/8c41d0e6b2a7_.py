@@ -0,0 +1,24 @@
+"""index shows by start time
+
+Revision ID: 8c41d0e6b2a7
+Revises: 3f9a2c1d7e85
+Create Date: 2026-10-18 20:21:40.913025
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c41d0e6b2a7'
+down_revision = '3f9a2c1d7e85'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_shows_start_time', 'shows', ['start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_shows_start_time', table_name='shows')
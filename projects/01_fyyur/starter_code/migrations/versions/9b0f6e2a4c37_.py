@@ -0,0 +1,46 @@
+"""upcoming and past show counters on venues and artists
+
+Revision ID: 9b0f6e2a4c37
+Revises: 5a7e3b9c0d12
+Create Date: 2026-10-18 21:14:26.551870
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b0f6e2a4c37'
+down_revision = '5a7e3b9c0d12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('venues', 'artists'):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+    watermark = op.create_table('show_counts_watermark',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('rolled_over_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    # backfill the counters as of now, the app compares with the local time
+    now = datetime.now()
+    op.bulk_insert(watermark, [{'id': 1, 'rolled_over_at': now}])
+    for table, key in (('venues', 'venue_id'), ('artists', 'artist_id')):
+        op.get_bind().execute(sa.text(
+            'UPDATE {table} SET '
+            'upcoming_shows_count = (SELECT count(*) FROM shows WHERE shows.{key} = {table}.id AND shows.start_time > :now), '
+            'past_shows_count = (SELECT count(*) FROM shows WHERE shows.{key} = {table}.id AND shows.start_time <= :now)'
+            .format(table=table, key=key)), now=now)
+
+
+def downgrade():
+    op.drop_table('show_counts_watermark')
+    for table in ('venues', 'artists'):
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
@@ -0,0 +1,24 @@
+"""index shows by artist and start time
+
+Revision ID: d25e7b93f4c1
+Revises: 8c41d0e6b2a7
+Create Date: 2026-10-18 20:38:03.227195
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd25e7b93f4c1'
+down_revision = '8c41d0e6b2a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_shows_artist_id_start_time', 'shows', ['artist_id', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_shows_artist_id_start_time', table_name='shows')
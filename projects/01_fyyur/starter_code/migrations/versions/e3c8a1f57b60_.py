@@ -0,0 +1,95 @@
+"""normalize genres into a genres table
+
+Revision ID: e3c8a1f57b60
+Revises: 9b0f6e2a4c37
+Create Date: 2026-10-18 21:46:09.381524
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3c8a1f57b60'
+down_revision = '9b0f6e2a4c37'
+branch_labels = None
+depends_on = None
+
+
+def parse_genres(value):
+    # the old columns hold whatever the form produced: a single genre, a
+    # comma separated list or a Postgres array literal like {Jazz,"R&B"}
+    names = []
+    for name in (value or '').strip().strip('{}').split(','):
+        name = name.strip().strip('"').strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def upgrade():
+    genres = op.create_table('genres',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('venue_genres',
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['genre_id'], ['genres.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['venue_id'], ['venues.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('venue_id', 'genre_id')
+    )
+    op.create_index('ix_venue_genres_genre_id', 'venue_genres', ['genre_id', 'venue_id'], unique=False)
+    op.create_table('artist_genres',
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['artists.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['genre_id'], ['genres.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('artist_id', 'genre_id')
+    )
+    op.create_index('ix_artist_genres_genre_id', 'artist_genres', ['genre_id', 'artist_id'], unique=False)
+    op.create_index('ix_artists_state', 'artists', ['state'], unique=False)
+
+    # backfill from the old string columns
+    bind = op.get_bind()
+    links = {}
+    for table, key in (('venues', 'venue_id'), ('artists', 'artist_id')):
+        rows = bind.execute(sa.text('SELECT id, genres FROM {}'.format(table)))
+        links[table, key] = [(row_id, name) for row_id, value in rows for name in parse_genres(value)]
+    names = sorted({name for table_links in links.values() for _, name in table_links})
+    op.bulk_insert(genres, [{'id': genre_id, 'name': name} for genre_id, name in enumerate(names, 1)])
+    if names and bind.dialect.name == 'postgresql':
+        bind.execute(sa.text("SELECT setval('genres_id_seq', :last)"), last=len(names))
+    genre_ids = {name: genre_id for genre_id, name in enumerate(names, 1)}
+    for (table, key), table_links in links.items():
+        association = sa.table(table[:-1] + '_genres', sa.column(key), sa.column('genre_id'))
+        op.bulk_insert(association, [{key: row_id, 'genre_id': genre_ids[name]} for row_id, name in table_links])
+
+    op.drop_column('venues', 'genres')
+    op.drop_column('artists', 'genres')
+
+
+def downgrade():
+    op.add_column('artists', sa.Column('genres', sa.String(length=120), nullable=True))
+    op.add_column('venues', sa.Column('genres', sa.String(length=120), nullable=True))
+
+    bind = op.get_bind()
+    for table, key in (('venues', 'venue_id'), ('artists', 'artist_id')):
+        rows = bind.execute(sa.text(
+            'SELECT a.{key}, g.name FROM {association} a JOIN genres g ON g.id = a.genre_id ORDER BY a.{key}, g.name'
+            .format(key=key, association=table[:-1] + '_genres')))
+        genres = {}
+        for row_id, name in rows:
+            genres.setdefault(row_id, []).append(name)
+        for row_id, names in genres.items():
+            bind.execute(sa.text('UPDATE {} SET genres = :genres WHERE id = :id'.format(table)),
+                         genres='{' + ','.join(names) + '}', id=row_id)
+
+    op.drop_index('ix_artists_state', table_name='artists')
+    op.drop_index('ix_artist_genres_genre_id', table_name='artist_genres')
+    op.drop_table('artist_genres')
+    op.drop_index('ix_venue_genres_genre_id', table_name='venue_genres')
+    op.drop_table('venue_genres')
+    op.drop_table('genres')
@@ -0,0 +1,239 @@
+import threading
+
+from sqlalchemy import event, func, or_
+from sqlalchemy.orm import Session
+
+
+'''
+Venue and artist search
+
+Case-insensitive partial search over the name and the "city, state" of
+venues and artists: "hop" finds "The Musical Hop" and "san fr" or "CA"
+finds everything in San Francisco, CA. Results are ranked (name prefix
+matches first, then by trigram similarity of the name) and paginated, and
+every result carries its maintained number of upcoming shows.
+
+On PostgreSQL the matching runs against pg_trgm GIN indexes on the name and
+on the location (see the migration that creates them). On other databases,
+SQLite in tests for example, it uses a trigram index kept in the current
+process.
+'''
+
+
+def normalize(text):
+    return ' '.join((text or '').lower().split())
+
+
+def escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def similarity(a, b):
+    # share of trigrams in common, like pg_trgm's similarity()
+    a, b = trigrams(a), trigrams(b)
+    if not a or not b:
+        return 0
+    return len(a & b) / len(a | b)
+
+
+class TrigramIndex(object):
+    """In-process index from trigram to the documents containing it.
+    A term of three characters or more is looked up by intersecting the
+    postings of its trigrams and checking the few candidates left; shorter
+    terms fall back to a scan.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.loaded = False
+        self._postings = {}
+        self._documents = {}
+
+    def load(self, rows):
+        """(Re)builds the index from (id, name, city, state) rows."""
+        with self._lock:
+            self._postings = {}
+            self._documents = {}
+            for row_id, name, city, state in rows:
+                self._add(row_id, name, city, state)
+            self.loaded = True
+
+    def invalidate(self):
+        """Drops the index, it is rebuilt on the next search."""
+        with self._lock:
+            self.loaded = False
+
+    def add(self, row_id, name, city, state):
+        with self._lock:
+            self._remove(row_id)
+            self._add(row_id, name, city, state)
+
+    def remove(self, row_id):
+        with self._lock:
+            self._remove(row_id)
+
+    def apply(self, changes):
+        """Applies committed changes, {id: (name, city, state) or None for a
+        deleted document}. Does nothing until the index is loaded; a load
+        running meanwhile holds the lock, so its changes are applied after.
+        """
+        with self._lock:
+            if not self.loaded:
+                return
+            for row_id, document in changes.items():
+                if document is None:
+                    self.remove(row_id)
+                else:
+                    self.add(row_id, *document)
+
+    def search(self, term):
+        """Returns the ids of the matching documents, best match first."""
+        term = normalize(term)
+        if not term:
+            return []
+        with self._lock:
+            if len(term) < 3:
+                candidates = self._documents
+            else:
+                candidates = None
+                for trigram in trigrams(term):
+                    postings = self._postings.get(trigram, ())
+                    candidates = set(postings) if candidates is None \
+                        else candidates & postings
+                    if not candidates:
+                        return []
+            ranked = []
+            for row_id in candidates:
+                name, location = self._documents[row_id]
+                if term in name:
+                    ranked.append((not name.startswith(term),
+                                   -similarity(name, term), name, row_id))
+                elif term in location:
+                    # location only matches rank after every name match
+                    ranked.append((True, 1, name, row_id))
+        return [row_id for *_, row_id in sorted(ranked)]
+
+    def _add(self, row_id, name, city, state):
+        name = normalize(name)
+        location = normalize(f'{city or ""}, {state or ""}')
+        self._documents[row_id] = (name, location)
+        for trigram in trigrams(name) | trigrams(location):
+            self._postings.setdefault(trigram, set()).add(row_id)
+
+    def _remove(self, row_id):
+        document = self._documents.pop(row_id, None)
+        if document is None:
+            return
+        for trigram in trigrams(document[0]) | trigrams(document[1]):
+            postings = self._postings.get(trigram)
+            if postings is None:
+                continue
+            postings.discard(row_id)
+            if not postings:
+                del self._postings[trigram]
+
+
+class EntitySearch(object):
+    """Search over the venues or the artists, model is Venue or Artist."""
+
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+        self.index = TrigramIndex()
+        self._listen()
+
+    def search(self, term, page, per_page):
+        """Returns (total, results) for one page of ranked results, every
+        result is a dict with id, name, city, state and num_upcoming_shows.
+        """
+        if self.db.engine.dialect.name == 'postgresql':
+            return self._search_postgresql(term, page, per_page)
+        return self._search_index(term, page, per_page)
+
+    def invalidate(self):
+        self.index.invalidate()
+
+    def location(self):
+        # must match the expression of the location trigram index
+        return self.model.city + ', ' + self.model.state
+
+    def _query(self, *columns):
+        model = self.model
+        return self.db.session.query(
+            model.id, model.name, model.city, model.state,
+            model.upcoming_shows_count.label('num_upcoming_shows'), *columns)
+
+    def _search_postgresql(self, term, page, per_page):
+        term = normalize(term)
+        if not term:
+            return 0, []
+        model = self.model
+        pattern = '%{}%'.format(escape_like(term))
+        matches = or_(model.name.ilike(pattern, escape='\\'),
+                      self.location().ilike(pattern, escape='\\'))
+        rows = self._query(func.count().over().label('total')) \
+            .filter(matches) \
+            .order_by(
+                model.name.ilike(escape_like(term) + '%', escape='\\').desc(),
+                func.similarity(model.name, term).desc(),
+                model.name, model.id) \
+            .offset((page - 1) * per_page).limit(per_page).all()
+        if not rows:
+            # past the last page the window count is not there, count apart
+            total = 0 if page == 1 else self.db.session.query(
+                func.count(model.id)).filter(matches).scalar()
+            return total, []
+        return rows[0].total, [self._result(row) for row in rows]
+
+    def _search_index(self, term, page, per_page):
+        model = self.model
+        if not self.index.loaded:
+            self.index.load(self.db.session.query(
+                model.id, model.name, model.city, model.state).yield_per(1000))
+        row_ids = self.index.search(term)
+        page_ids = row_ids[(page - 1) * per_page:page * per_page]
+        if not page_ids:
+            return len(row_ids), []
+        rows = {row.id: row for row in
+                self._query().filter(model.id.in_(page_ids))}
+        return len(row_ids), [self._result(rows[row_id])
+                              for row_id in page_ids if row_id in rows]
+
+    def _result(self, row):
+        return {
+            'id': row.id,
+            'name': row.name,
+            'city': row.city,
+            'state': row.state,
+            'num_upcoming_shows': row.num_upcoming_shows
+        }
+
+    def _listen(self):
+        # keep the in-process index in step with committed changes, recorded
+        # even while the index is not loaded: it may be built by another
+        # request between the flush and the commit
+        key = 'search_changes_{}'.format(self.model.__tablename__)
+
+        @event.listens_for(Session, 'after_flush')
+        def record_changes(session, flush_context):
+            changes = session.info.setdefault(key, {})
+            for row in session.new | session.dirty:
+                if isinstance(row, self.model):
+                    changes[row.id] = (row.name, row.city, row.state)
+            for row in session.deleted:
+                if isinstance(row, self.model):
+                    changes[row.id] = None
+
+        @event.listens_for(Session, 'after_commit')
+        def apply_changes(session):
+            changes = session.info.pop(key, None)
+            if changes:
+                self.index.apply(changes)
+
+        @event.listens_for(Session, 'after_soft_rollback')
+        def discard_changes(session, previous_transaction):
+            session.info.pop(key, None)
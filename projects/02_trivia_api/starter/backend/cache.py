@@ -0,0 +1,79 @@
+import hashlib
+import json
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import Category
+
+
+'''
+CategoryCache
+
+Process-level cache of the {id: type} category map. Categories almost
+never change, so the map is only reloaded when it is invalidated or
+after ``ttl`` seconds, which also picks up changes made by other
+processes.
+'''
+
+
+class CategoryCache(object):
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._categories = None
+        self._etag = None
+        self._expires_at = 0
+
+    def get(self):
+        """Returns the category map and its ETag, loading them if needed."""
+        with self._lock:
+            if self._categories is None or self._expires_at < time.time():
+                self._load()
+            return self._categories, self._etag
+
+    def get_categories(self):
+        return self.get()[0]
+
+    def invalidate(self):
+        """Drops the cached map, the next get() reloads it."""
+        with self._lock:
+            self._categories = None
+
+    def _load(self):
+        categories = {}
+        for category in Category.query.order_by(Category.id).all():
+            categories[category.id] = category.type
+        body = json.dumps(sorted(categories.items())).encode('utf-8')
+        self._categories = categories
+        self._etag = hashlib.sha1(body).hexdigest()
+        self._expires_at = time.time() + self.ttl
+
+
+category_cache = CategoryCache()
+
+
+# invalidate the cache whenever a category is written through the ORM.
+# The change is noted at flush time but the cache is only dropped once the
+# transaction commits: dropped earlier, a concurrent get() would reload the
+# old committed map and keep it for the whole ttl
+@event.listens_for(Session, 'after_flush')
+def record_category_changes(session, flush_context):
+    for row in session.new | session.dirty | session.deleted:
+        if isinstance(row, Category):
+            session.info['categories_changed'] = True
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_category_cache(session):
+    if session.info.pop('categories_changed', False):
+        category_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_category_changes(session, previous_transaction):
+    session.info.pop('categories_changed', None)
@@ -1,11 +1,16 @@
 import os
+import json
 from flask import Flask, request, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
+from sqlalchemy.exc import SQLAlchemyError
 
-from models import setup_db, Question, Category
-from utils import get_paginated_questions
+from models import setup_db, db, Question
+from utils import paginate_query, get_random_question
+from quiz_sessions import make_quiz_session_store
+from cache import category_cache
+from search import question_search
+from streaming import stream_ndjson
 
 
 QUESTIONS_PER_PAGE = 10
@@ -16,8 +21,24 @@ QUESTIONS_PER_PAGE = 10
 def create_app(test_config=None):
   # create and configure the app
   app = Flask(__name__)
+  app.config.from_mapping(
+    QUIZ_SESSION_STORE='memory',
+    QUIZ_SESSION_TTL=3600,
+    QUIZ_SESSION_MAX=10000,
+    CATEGORY_CACHE_TTL=300,
+    BULK_BATCH_SIZE=1000
+  )
+  if test_config:
+    app.config.update(test_config)
   setup_db(app)
 
+  category_cache.ttl = app.config['CATEGORY_CACHE_TTL']
+  category_cache.invalidate()
+
+  quiz_sessions = make_quiz_session_store(app.config['QUIZ_SESSION_STORE'],
+                                          app.config['QUIZ_SESSION_TTL'],
+                                          app.config['QUIZ_SESSION_MAX'])
+
   
   '''
   @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -41,13 +62,14 @@ def create_app(test_config=None):
 
   @app.route('/categories', methods=['GET'])
   def get_all_categories():
-    
-    categories = {}
-    for category in Category.query.all():
-      categories[category.id] = category.type
-    return jsonify({
+    categories, etag = category_cache.get()
+    response = jsonify({
+      'success': True,
       'categories': categories
     })
+        # answer 304 when the client already has this version
+    response.set_etag(etag)
+    return response.make_conditional(request)
 
   '''
   @TODO: 
@@ -65,17 +87,22 @@ def create_app(test_config=None):
   
   @app.route('/questions', methods=['GET'])
   def get_questions():
-    categories = {}
-    for category in Category.query.all():
-      categories[category.id] = category.type
-    questions = [question.format() for question in Question.query.all()]
-    page = int(request.args.get('page', '0'))
-    upper_limit = page * 10
-    lower_limit = upper_limit - 10
+    categories = category_cache.get_categories()
+
+    # ?after_id= switches to keyset paging, which stays cheap on deep pages;
+    # otherwise fall back to LIMIT/OFFSET on ?page=
+    page = paginate_query(request, Question.query, Question.id,
+                          QUESTIONS_PER_PAGE)
+
+    if len(page['items']) == 0:
+      abort(404)
+
     return jsonify({
-      'questions': questions[
-                         lower_limit:upper_limit] if page else questions,
-      'total_questions': len(questions),
+      'success': True,
+      'questions': page['items'],
+      'total_questions': page['total'],
+      'has_next': page['has_next'],
+      'next_cursor': page['next_cursor'],
       'categories': categories
     })
 
@@ -117,6 +144,13 @@ def create_app(test_config=None):
       return abort(400,
                          'Required question object keys missing from request '
                          'body')
+    try:
+      category = int(category)
+      difficulty = int(difficulty)
+    except (TypeError, ValueError):
+      abort(400)
+    if category not in category_cache.get_categories():
+      abort(422)
     question_entry = Question(question, answer, category, difficulty)
     question_entry.insert()
     return jsonify({
@@ -125,6 +159,99 @@ def create_app(test_config=None):
   
 
 
+  '''
+  Bulk import and export of questions as JSON Lines (one question per line).
+  Imports are inserted in batches of BULK_BATCH_SIZE rows, one transaction
+  per batch; exports stream from a server-side cursor.
+  '''
+  @app.route('/questions/bulk', methods=['POST'])
+  def bulk_insert_questions():
+    batch_size = app.config['BULK_BATCH_SIZE']
+    categories = category_cache.get_categories()
+    inserted = 0
+    errors = []
+    batch = []
+    line_count = 0
+
+    for line_number, line in enumerate(request.stream, 1):
+      if not line.strip():
+        continue
+      line_count += 1
+      try:
+        batch.append((line_number, parse_question_line(line, categories)))
+      except ValueError as error:
+        errors.append({'line': line_number, 'error': str(error)})
+        continue
+      if len(batch) >= batch_size:
+        inserted += insert_question_batch(batch, errors)
+        batch = []
+    if batch:
+      inserted += insert_question_batch(batch, errors)
+
+    if line_count == 0:
+      abort(400)
+    if inserted:
+      question_search.invalidate()
+
+    return jsonify({
+      'success': True,
+      'inserted': inserted,
+      'errors': errors
+    }), 200
+
+  @app.route('/questions/export', methods=['GET'])
+  def export_questions():
+    questions = Question.query.order_by(Question.id).execution_options(
+      stream_results=True).yield_per(app.config['BULK_BATCH_SIZE'])
+    return stream_ndjson(questions, Question.format)
+
+  def parse_question_line(line, categories):
+    try:
+      data = json.loads(line)
+    except ValueError:
+      raise ValueError('Invalid JSON')
+    if not isinstance(data, dict):
+      raise ValueError('Expected a question object')
+    question = data.get('question')
+    answer = data.get('answer')
+    if not (isinstance(question, str) and question.strip() and
+            isinstance(answer, str) and answer.strip()):
+      raise ValueError('question and answer must be non-empty strings')
+    try:
+      category = int(data.get('category'))
+      difficulty = int(data.get('difficulty'))
+    except (TypeError, ValueError):
+      raise ValueError('category and difficulty must be integers')
+    if category not in categories:
+      raise ValueError('Unknown category: {}'.format(category))
+    return {
+      'question': question,
+      'answer': answer,
+      'category': category,
+      'difficulty': difficulty
+    }
+
+  def insert_question_batch(batch, errors):
+    try:
+      db.session.bulk_insert_mappings(Question, [row for _, row in batch])
+      db.session.commit()
+      return len(batch)
+    except SQLAlchemyError:
+      db.session.rollback()
+
+        # find the offending rows by inserting the batch one row at a time
+    inserted = 0
+    for line_number, row in batch:
+      try:
+        db.session.bulk_insert_mappings(Question, [row])
+        db.session.commit()
+        inserted += 1
+      except SQLAlchemyError as error:
+        db.session.rollback()
+        errors.append({'line': line_number,
+                       'error': error.__class__.__name__})
+    return inserted
+
   '''
   @TODO: 
   Create a POST endpoint to get questions based on a search term. 
@@ -138,18 +265,19 @@ def create_app(test_config=None):
     if search_term == '':
       abort(422)
 
+    page = request.args.get('page', 1, type=int)
     try:
-      questions = Question.query.filter(Question.question.ilike(f'%{search_term}%')).all()
-                
-      if len(questions) == 0:
+      total, questions = question_search.search(
+        search_term, max(page, 1), QUESTIONS_PER_PAGE)
+
+      if total == 0:
         abort(404)
-      paginated_questions = get_paginated_questions(request, questions, QUESTIONS_PER_PAGE) 
-                
-                
+
       return jsonify({
         'success': True,
-        'questions': paginated_questions,
-        'total_questions': len(Question.query.all())
+        'questions': [question.format() for question in questions],
+        'total_questions': total,
+        'has_next': page * QUESTIONS_PER_PAGE < total
       }), 200
     except Exception:
       abort(404)
@@ -166,25 +294,26 @@ def create_app(test_config=None):
   @app.route('/categories/<int:id>/questions')
   def get_questions_by_category(id):
 
-    category = Category.query.filter_by(id=id).one_or_none()
+    category_type = category_cache.get_categories().get(id)
 
         # abort 400 for bad request if category isn't found
-    if (category is None):
+    if (category_type is None):
       abort(422)
 
-    questions = Question.query.filter_by(category=id).all()
+    questions = Question.query.filter_by(category=id)
 
-        # paginate questions
-    paginated_questions = get_paginated_questions(
-            request, questions,
-            QUESTIONS_PER_PAGE)
+        # paginate questions in the database
+    page = paginate_query(request, questions, Question.id,
+                          QUESTIONS_PER_PAGE)
 
         # return the results
     return jsonify({
       'success': True,
-      'questions': paginated_questions,
-      'total_questions': len(questions),
-      'current_category': category.type
+      'questions': page['items'],
+      'total_questions': page['total'],
+      'has_next': page['has_next'],
+      'next_cursor': page['next_cursor'],
+      'current_category': category_type
     })
   
   '''
@@ -201,43 +330,86 @@ def create_app(test_config=None):
   @app.route('/quizzes', methods=['POST'])
   def play_quiz_question():
     data = request.get_json()
+    session_token = data.get('quiz_session')
     previous_questions = data.get('previous_questions')
     quiz_category = data.get('quiz_category')
 
+        # an ongoing quiz session already knows its remaining questions
+    if session_token is not None:
+      if not isinstance(session_token, str):
+        abort(400)
+      return play_quiz_session(session_token)
+
+    if data.get('start_session') and previous_questions is None:
+      previous_questions = []
+
         # return 404 if quiz_category or previous_questions is empty
     if ((quiz_category is None) or (previous_questions is None)):
       abort(400)
 
-    if (quiz_category['id'] == 0):
-      questions = Question.query.all()
-    else:
-      questions = Question.query.filter_by(category=quiz_category['id']).all()
+    try:
+      category_id = int(quiz_category['id'])
+      previous_ids = [int(question_id) for question_id in previous_questions]
+    except (KeyError, TypeError, ValueError):
+      abort(400)
 
-                
-        # defines a random question generator method
-    def get_random_question():
-      return questions[random.randint(0, len(questions)-1)]
+    if (category_id == 0):
+      questions = Question.query
+    else:
+      questions = Question.query.filter_by(category=category_id)
 
-        # get random question for the next question
-    next_question = get_random_question()
+    if data.get('start_session'):
+      return start_quiz_session(questions, previous_ids)
 
-        # defines boolean used to check that the question
-        # is not a previous question
-    found = True
+        # pick a random question that is not a previous question
+    next_question = get_random_question(questions, Question.id, previous_ids)
 
-    while found:
-      if next_question.id in previous_questions:
-        next_question = get_random_question()
-      else:
-        found = False
+        # every question of the category was played, end the quiz
+    if next_question is None:
+      return jsonify({
+        'success': True,
+        'question': None,
+        'quiz_exhausted': True
+      }), 200
 
     return jsonify({
       'success': True,
       'question': next_question.format(),
+      'quiz_exhausted': False
     }), 200
 
   
 
+  def start_quiz_session(questions, previous_ids):
+    # shuffle the ids of the category once, then serve them in order
+    if previous_ids:
+      questions = questions.filter(~Question.id.in_(previous_ids))
+    question_ids = questions.with_entities(Question.id)
+    token = quiz_sessions.create(
+      question_id for (question_id,) in question_ids)
+    return play_quiz_session(token)
+
+  def play_quiz_session(token):
+    try:
+      while True:
+        question_id = quiz_sessions.next_question_id(token)
+        if question_id is None:
+          next_question = None
+          break
+            # skip questions deleted since the session started
+        next_question = Question.query.get(question_id)
+        if next_question is not None:
+          break
+    except KeyError:
+      abort(404)
+
+    return jsonify({
+      'success': True,
+      'question': next_question.format() if next_question else None,
+      'quiz_exhausted': next_question is None,
+      'quiz_session': token
+    }), 200
+
   '''
   @TODO: 
   Create error handlers for all expected errors 
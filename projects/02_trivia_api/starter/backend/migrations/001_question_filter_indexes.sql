@@ -0,0 +1,38 @@
+--
+-- Indexes for the hot question filters
+--
+-- questions.category is filtered on by /categories/<id>/questions and
+-- /quizzes and compared with integer category ids, so it has to be an
+-- integer foreign key to categories with an index. The (category, id)
+-- index also serves the keyset pages of a category.
+--
+-- Run once against an existing database:
+--   psql trivia < migrations/001_question_filter_indexes.sql
+--
+-- On a large, busy table create the indexes with CREATE INDEX CONCURRENTLY
+-- outside of the transaction instead.
+--
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'questions' AND column_name = 'category') <> 'integer' THEN
+        ALTER TABLE public.questions
+            ALTER COLUMN category TYPE integer USING category::integer;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conrelid = 'public.questions'::regclass AND contype = 'f') THEN
+        ALTER TABLE public.questions
+            ADD CONSTRAINT category FOREIGN KEY (category) REFERENCES public.categories(id)
+            ON UPDATE CASCADE ON DELETE SET NULL;
+    END IF;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS ix_questions_category_id ON public.questions USING btree (category, id);
+CREATE INDEX IF NOT EXISTS ix_questions_difficulty ON public.questions USING btree (difficulty);
+
+COMMIT;
@@ -0,0 +1,21 @@
+--
+-- Full-text search index for /questions/search
+--
+-- A GIN index over the weighted tsvector of the question (weight A) and of
+-- its answer (weight B). The expression must stay identical to
+-- SEARCH_DOCUMENT_SQL in search.py, otherwise the planner does not use it.
+--
+-- Run once against an existing database:
+--   psql trivia < migrations/002_question_search_index.sql
+--
+-- On a large, busy table create the index with CREATE INDEX CONCURRENTLY
+-- outside of the transaction instead.
+--
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS ix_questions_search ON public.questions USING gin ((
+    setweight(to_tsvector('english', coalesce(question, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(answer, '')), 'B')));
+
+COMMIT;
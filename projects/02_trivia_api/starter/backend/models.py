@@ -1,5 +1,9 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+import threading
+import warnings
+from contextlib import contextmanager
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, create_engine, inspect, text
+from sqlalchemy.exc import SAWarning
 from flask_sqlalchemy import SQLAlchemy
 import json
 
@@ -18,6 +22,86 @@ def setup_db(app, database_path=database_path):
     db.app = app
     db.init_app(app)
     db.create_all()
+    check_indexes(app)
+
+'''
+check_indexes(app)
+    warns when an index the queries rely on is missing from the database,
+    see migrations/ for the scripts that create them
+    an index is expected either by its columns or, for an expression index
+    that cannot be reflected, by its name (PostgreSQL only)
+'''
+EXPECTED_INDEXES = {
+    'questions': [('category', 'id'), ('difficulty',), 'ix_questions_search']
+}
+
+def check_indexes(app):
+    inspector = inspect(db.engine)
+    postgresql = db.engine.dialect.name == 'postgresql'
+    for table, expected in EXPECTED_INDEXES.items():
+        with warnings.catch_warnings():
+            # expression indexes are skipped with a warning, checked below
+            warnings.simplefilter('ignore', SAWarning)
+            existing = set(tuple(index['column_names'])
+                           for index in inspector.get_indexes(table))
+        if postgresql:
+            existing.update(row[0] for row in db.engine.execute(
+                text('SELECT indexname FROM pg_indexes WHERE tablename = :table'),
+                table=table))
+        for index in expected:
+            if isinstance(index, str):
+                if postgresql and index not in existing:
+                    app.logger.warning(
+                        'Missing index %s on %s, run the scripts in migrations/',
+                        index, table)
+            elif index not in existing:
+                app.logger.warning(
+                    'Missing index on %s (%s), run the scripts in migrations/',
+                    table, ', '.join(index))
+
+'''
+batch(chunk_size=500)
+    unit of work for the model insert/update/delete helpers
+    inside the block the helpers do not commit: pending changes are flushed
+    every chunk_size operations and committed once when the block exits,
+    or rolled back if it raises. Nested blocks join the outer one.
+    !!NOTE new rows only get their id when the batch is flushed
+    EXAMPLE
+        with batch():
+            for row in rows:
+                Question(**row).insert()
+'''
+_unit_of_work = threading.local()
+
+@contextmanager
+def batch(chunk_size=500):
+    if getattr(_unit_of_work, 'pending', None) is not None:
+        yield
+        return
+
+    _unit_of_work.pending = 0
+    _unit_of_work.chunk_size = chunk_size
+    try:
+        yield
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+    finally:
+        _unit_of_work.pending = None
+
+'''
+commit()
+    commits the session now, or joins the current batch() if there is one
+'''
+def commit():
+    if getattr(_unit_of_work, 'pending', None) is None:
+        db.session.commit()
+        return
+    _unit_of_work.pending += 1
+    if _unit_of_work.pending >= _unit_of_work.chunk_size:
+        db.session.flush()
+        _unit_of_work.pending = 0
 
 '''
 Question
@@ -25,12 +109,17 @@ Question
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  __table_args__ = (
+    # serves category filters and keyset paging inside a category
+    Index('ix_questions_category_id', 'category', 'id'),
+  )
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
-  category = Column(String)
-  difficulty = Column(Integer)
+  category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE',
+                                        ondelete='SET NULL'))
+  difficulty = Column(Integer, index=True)
 
   def __init__(self, question, answer, category, difficulty):
     self.question = question
@@ -40,14 +129,14 @@ class Question(db.Model):
 
   def insert(self):
     db.session.add(self)
-    db.session.commit()
+    commit()
   
   def update(self):
-    db.session.commit()
+    commit()
 
   def delete(self):
     db.session.delete(self)
-    db.session.commit()
+    commit()
 
   def format(self):
     return {
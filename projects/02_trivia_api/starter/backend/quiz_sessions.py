@@ -0,0 +1,214 @@
+import os
+import random
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+'''
+Quiz sessions
+
+A quiz session holds a pre-shuffled permutation of question ids for one
+quiz, so /quizzes can hand out the next question by moving a cursor
+instead of receiving and scanning the whole previous_questions list.
+Sessions expire after ``ttl`` seconds without being used, and at most
+``max_sessions`` are kept: past that the least recently used sessions are
+dropped, so anonymous clients cannot grow the store without bound.
+'''
+
+
+class QuizSessionStore(object):
+    """Base class of the quiz session stores.
+    Subclasses implement _create, _next and _evict_expired.
+    """
+
+    def __init__(self, ttl=3600, eviction_interval=60, max_sessions=10000):
+        self.ttl = ttl
+        self.eviction_interval = eviction_interval
+        self.max_sessions = max_sessions
+        self._last_eviction = time.time()
+
+    def create(self, question_ids):
+        """Stores a shuffled copy of question_ids and returns the token
+        of the new session.
+        """
+        question_ids = list(question_ids)
+        random.shuffle(question_ids)
+        self._maybe_evict()
+        token = secrets.token_urlsafe(16)
+        self._create(token, question_ids, time.time() + self.ttl)
+        return token
+
+    def next_question_id(self, token):
+        """Returns the next question id of the session, or None once every
+        question was handed out. Raises KeyError for an unknown or expired
+        token.
+        """
+        self._maybe_evict()
+        return self._next(token, time.time())
+
+    def _maybe_evict(self):
+        now = time.time()
+        if now - self._last_eviction >= self.eviction_interval:
+            self._last_eviction = now
+            self._evict_expired(now)
+
+    def _create(self, token, question_ids, expires_at):
+        raise NotImplementedError
+
+    def _next(self, token, now):
+        raise NotImplementedError
+
+    def _evict_expired(self, now):
+        raise NotImplementedError
+
+
+class MemoryQuizSessionStore(QuizSessionStore):
+    """Keeps the sessions in a dict of the current process, ordered from
+    the least to the most recently used.
+    The permutation is consumed from its end, so each call is O(1).
+    """
+
+    def __init__(self, ttl=3600, eviction_interval=60, max_sessions=10000):
+        super(MemoryQuizSessionStore, self).__init__(ttl, eviction_interval,
+                                                     max_sessions)
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _create(self, token, question_ids, expires_at):
+        with self._lock:
+            while len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+            self._sessions[token] = [expires_at, question_ids]
+
+    def _next(self, token, now):
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None or session[0] < now:
+                self._sessions.pop(token, None)
+                raise KeyError(token)
+            session[0] = now + self.ttl
+            self._sessions.move_to_end(token)
+            if not session[1]:
+                return None
+            return session[1].pop()
+
+    def _evict_expired(self, now):
+        with self._lock:
+            expired = [token for token, session in self._sessions.items()
+                       if session[0] < now]
+            for token in expired:
+                del self._sessions[token]
+
+
+class SQLiteQuizSessionStore(QuizSessionStore):
+    """Keeps the sessions in a SQLite file, so they survive restarts and
+    can be shared by several worker processes on one host.
+    Each question id is its own row keyed by (token, position), so handing
+    out the next question is an index lookup and not a decode of the whole
+    permutation.
+    """
+
+    def __init__(self, path, ttl=3600, eviction_interval=60,
+                 max_sessions=10000):
+        super(SQLiteQuizSessionStore, self).__init__(ttl, eviction_interval,
+                                                     max_sessions)
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS quiz_sessions (
+                    token TEXT PRIMARY KEY,
+                    position INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_quiz_sessions_expires_at
+                    ON quiz_sessions (expires_at);
+                CREATE TABLE IF NOT EXISTS quiz_session_questions (
+                    token TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    question_id INTEGER NOT NULL,
+                    PRIMARY KEY (token, position)
+                ) WITHOUT ROWID;
+            ''')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            self._local.connection = connection
+        return connection
+
+    def _create(self, token, question_ids, expires_at):
+        with self._connection() as connection:
+            # expires_at is the last use plus ttl: the smallest are the
+            # least recently used sessions
+            count = connection.execute(
+                'SELECT count(*) FROM quiz_sessions').fetchone()[0]
+            if count >= self.max_sessions:
+                tokens = connection.execute(
+                    'SELECT token FROM quiz_sessions ORDER BY expires_at '
+                    'LIMIT ?', (count - self.max_sessions + 1,)).fetchall()
+                for (old_token,) in tokens:
+                    self._delete(connection, old_token)
+            connection.execute(
+                'INSERT INTO quiz_sessions VALUES (?, 0, ?, ?)',
+                (token, len(question_ids), expires_at))
+            connection.executemany(
+                'INSERT INTO quiz_session_questions VALUES (?, ?, ?)',
+                [(token, position, question_id)
+                 for position, question_id in enumerate(question_ids)])
+
+    def _next(self, token, now):
+        with self._connection() as connection:
+            row = connection.execute(
+                'SELECT position, size, expires_at FROM quiz_sessions '
+                'WHERE token = ?', (token,)).fetchone()
+            if row is None or row[2] < now:
+                self._delete(connection, token)
+                raise KeyError(token)
+            position, size, _ = row
+            if position >= size:
+                connection.execute(
+                    'UPDATE quiz_sessions SET expires_at = ? WHERE token = ?',
+                    (now + self.ttl, token))
+                return None
+            # only advance the cursor if nobody else did it meanwhile
+            updated = connection.execute(
+                'UPDATE quiz_sessions SET position = ?, expires_at = ? '
+                'WHERE token = ? AND position = ?',
+                (position + 1, now + self.ttl, token, position)).rowcount
+            if not updated:
+                return self._next(token, now)
+            return connection.execute(
+                'SELECT question_id FROM quiz_session_questions '
+                'WHERE token = ? AND position = ?',
+                (token, position)).fetchone()[0]
+
+    def _evict_expired(self, now):
+        with self._connection() as connection:
+            tokens = connection.execute(
+                'SELECT token FROM quiz_sessions WHERE expires_at < ?',
+                (now,)).fetchall()
+            for (token,) in tokens:
+                self._delete(connection, token)
+
+    def _delete(self, connection, token):
+        connection.execute(
+            'DELETE FROM quiz_session_questions WHERE token = ?', (token,))
+        connection.execute(
+            'DELETE FROM quiz_sessions WHERE token = ?', (token,))
+
+
+def make_quiz_session_store(url, ttl=3600, max_sessions=10000):
+    """Builds the store named by url: 'memory' or 'sqlite:///<path>'."""
+    if url == 'memory':
+        return MemoryQuizSessionStore(ttl=ttl, max_sessions=max_sessions)
+    if url.startswith('sqlite:///'):
+        path = url[len('sqlite:///'):]
+        return SQLiteQuizSessionStore(os.path.abspath(path), ttl=ttl,
+                                      max_sessions=max_sessions)
+    raise ValueError('Unknown quiz session store: {}'.format(url))
@@ -0,0 +1,218 @@
+import bisect
+import re
+import threading
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from models import db, Question
+
+
+'''
+Question search
+
+Full-text search over the question and answer text, ranked by relevance.
+Every word of the search term must match the start of a word of the
+question or of its answer, and matches in the question rank higher.
+
+On PostgreSQL the search runs against a GIN index on a weighted tsvector
+(see migrations/002_question_search_index.sql). On other databases, SQLite in the tests for
+example, it uses an inverted index kept in the current process.
+'''
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+QUESTION_WEIGHT = 2
+ANSWER_WEIGHT = 1
+
+# must match the expression of ix_questions_search, see migrations/
+SEARCH_DOCUMENT_SQL = (
+    "setweight(to_tsvector('english', coalesce(question, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(answer, '')), 'B')")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall((text or '').lower())
+
+
+class QuestionSearchIndex(object):
+    """In-process inverted index from word to the questions using it.
+    Word prefixes are matched through a sorted vocabulary, so every word
+    of a search term costs one binary search plus the matching postings.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.loaded = False
+        self._postings = {}
+        self._documents = {}
+        self._vocabulary = []
+
+    def load(self, rows):
+        """(Re)builds the index from (id, question, answer) rows."""
+        with self._lock:
+            self._postings = {}
+            self._documents = {}
+            for question_id, question, answer in rows:
+                self._add(question_id, question, answer)
+            self._vocabulary = sorted(self._postings)
+            self.loaded = True
+
+    def invalidate(self):
+        """Drops the index, it is rebuilt on the next search."""
+        with self._lock:
+            self.loaded = False
+
+    def add(self, question_id, question, answer):
+        with self._lock:
+            self._remove(question_id)
+            for word in self._add(question_id, question, answer):
+                index = bisect.bisect_left(self._vocabulary, word)
+                if (index == len(self._vocabulary) or
+                        self._vocabulary[index] != word):
+                    self._vocabulary.insert(index, word)
+
+    def remove(self, question_id):
+        with self._lock:
+            self._remove(question_id)
+
+    def apply(self, changes):
+        """Applies committed changes, {id: (question, answer) or None for a
+        deleted question}. Does nothing until the index is loaded; a load
+        running meanwhile holds the lock, so its changes are applied after.
+        """
+        with self._lock:
+            if not self.loaded:
+                return
+            for question_id, document in changes.items():
+                if document is None:
+                    self.remove(question_id)
+                else:
+                    self.add(question_id, *document)
+
+    def search(self, term):
+        """Returns the ids of the matching questions, best match first."""
+        words = tokenize(term)
+        if not words:
+            return []
+        with self._lock:
+            scores = None
+            for word in words:
+                word_scores = self._prefix_scores(word)
+                if scores is None:
+                    scores = word_scores
+                else:
+                    scores = {question_id: score + word_scores[question_id]
+                              for question_id, score in scores.items()
+                              if question_id in word_scores}
+                if not scores:
+                    return []
+        return sorted(scores, key=lambda question_id: (-scores[question_id],
+                                                       question_id))
+
+    def _prefix_scores(self, prefix):
+        scores = {}
+        index = bisect.bisect_left(self._vocabulary, prefix)
+        while (index < len(self._vocabulary) and
+               self._vocabulary[index].startswith(prefix)):
+            postings = self._postings[self._vocabulary[index]]
+            for question_id, weight in postings.items():
+                scores[question_id] = scores.get(question_id, 0) + weight
+            index += 1
+        return scores
+
+    def _add(self, question_id, question, answer):
+        weights = {}
+        for word in tokenize(question):
+            weights[word] = weights.get(word, 0) + QUESTION_WEIGHT
+        for word in tokenize(answer):
+            weights[word] = weights.get(word, 0) + ANSWER_WEIGHT
+        for word, weight in weights.items():
+            self._postings.setdefault(word, {})[question_id] = weight
+        self._documents[question_id] = list(weights)
+        return weights
+
+    def _remove(self, question_id):
+        for word in self._documents.pop(question_id, ()):
+            postings = self._postings.get(word)
+            if postings is None:
+                continue
+            postings.pop(question_id, None)
+            if not postings:
+                del self._postings[word]
+                index = bisect.bisect_left(self._vocabulary, word)
+                if (index < len(self._vocabulary) and
+                        self._vocabulary[index] == word):
+                    del self._vocabulary[index]
+
+
+class QuestionSearch(object):
+
+    def __init__(self):
+        self.index = QuestionSearchIndex()
+
+    def search(self, term, page, per_page):
+        """Returns (total, questions) for one page of ranked results."""
+        if db.engine.dialect.name == 'postgresql':
+            return self._search_postgresql(term, page, per_page)
+        return self._search_index(term, page, per_page)
+
+    def invalidate(self):
+        self.index.invalidate()
+
+    def _search_postgresql(self, term, page, per_page):
+        words = tokenize(term)
+        if not words:
+            return 0, []
+        document = db.literal_column('({})'.format(SEARCH_DOCUMENT_SQL))
+        query = func.to_tsquery(
+            'english', ' & '.join(word + ':*' for word in words))
+        matches = Question.query.filter(document.op('@@')(query))
+        total = matches.with_entities(func.count(Question.id)).scalar()
+        questions = matches.order_by(
+            func.ts_rank(document, query).desc(), Question.id).offset(
+                (page - 1) * per_page).limit(per_page).all()
+        return total, questions
+
+    def _search_index(self, term, page, per_page):
+        if not self.index.loaded:
+            self.index.load(db.session.query(
+                Question.id, Question.question, Question.answer).yield_per(
+                    1000))
+        question_ids = self.index.search(term)
+        page_ids = question_ids[(page - 1) * per_page:page * per_page]
+        if not page_ids:
+            return len(question_ids), []
+        questions = {question.id: question for question in
+                     Question.query.filter(Question.id.in_(page_ids))}
+        return len(question_ids), [questions[question_id]
+                                   for question_id in page_ids
+                                   if question_id in questions]
+
+
+question_search = QuestionSearch()
+
+
+# keep the in-process index in step with committed question changes
+# changes are recorded even while the index is not loaded: it may be built
+# by another request between this flush and the commit
+@event.listens_for(Session, 'after_flush')
+def record_question_changes(session, flush_context):
+    changes = session.info.setdefault('question_search_changes', {})
+    for question in session.new | session.dirty:
+        if isinstance(question, Question):
+            changes[question.id] = (question.question, question.answer)
+    for question in session.deleted:
+        if isinstance(question, Question):
+            changes[question.id] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_question_changes(session):
+    changes = session.info.pop('question_search_changes', None)
+    if changes:
+        question_search.index.apply(changes)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_question_changes(session, previous_transaction):
+    session.info.pop('question_search_changes', None)
@@ -0,0 +1,85 @@
+import json
+import zlib
+
+from flask import Response, request, stream_with_context
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+'''
+Streaming JSON Lines responses
+
+stream_ndjson() writes one JSON document per line for every item of an
+iterator, instead of building the whole body in memory like jsonify() does.
+Meant for unbounded results, a query with yield_per() for example; small,
+paginated responses are better served by jsonify(), which keeps the
+Content-Length. Lines are sent in chunks of about CHUNK_SIZE bytes with
+chunked transfer encoding and compressed with brotli or gzip when the
+client accepts it.
+'''
+
+CHUNK_SIZE = 16 * 1024
+
+
+def stream_ndjson(items, serialize=None, status=200):
+    """Returns a streamed application/x-ndjson response of items.
+    serialize turns each item into something json.dumps accepts.
+    """
+    encoding = negotiate_encoding()
+    body = _encode(_ndjson_chunks(items, serialize), encoding)
+    response = Response(stream_with_context(body), status=status,
+                        mimetype='application/x-ndjson')
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def negotiate_encoding():
+    """Picks br or gzip from Accept-Encoding, None for identity."""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _ndjson_chunks(items, serialize):
+    buffer = []
+    size = 0
+    for item in items:
+        if serialize is not None:
+            item = serialize(item)
+        line = json.dumps(item) + '\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def _encode(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor()
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    else:
+        for chunk in chunks:
+            yield chunk
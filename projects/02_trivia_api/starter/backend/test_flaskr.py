@@ -4,7 +4,8 @@ import json
 from flask_sqlalchemy import SQLAlchemy
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from models import setup_db, batch, Question, Category
+from quiz_sessions import MemoryQuizSessionStore
 from utils import create_mock_question
 
 
@@ -39,6 +40,18 @@ class TriviaTestCase(unittest.TestCase):
     TODO
     Write at least one test for each test for successful operation and for expected errors.
     """
+    def test_get_categories_not_modified(self):
+      response = self.client().get('/categories')
+      etag = response.headers.get('ETag')
+      self.assertEqual(response.status_code, 200)
+      self.assertTrue(etag)
+
+        # same version of the categories, nothing to send again
+      response = self.client().get('/categories',
+                                   headers={'If-None-Match': etag})
+      self.assertEqual(response.status_code, 304)
+      self.assertEqual(response.data, b'')
+
     def test_get_paginated_questions(self):
       response = self.client().get('/questions')
       data = json.loads(response.data)
@@ -60,6 +73,19 @@ class TriviaTestCase(unittest.TestCase):
       self.assertEqual(data['success'], False)
       self.assertEqual(data['message'], 'Resource not found')
     
+    def test_get_questions_with_after_id_cursor(self):
+      first_page = json.loads(self.client().get('/questions').data)
+      response = self.client().get(
+            '/questions?after_id={}'.format(first_page['next_cursor']))
+      data = json.loads(response.data)
+
+        # keyset page should start right after the cursor
+      self.assertEqual(response.status_code, 200)
+      self.assertEqual(data['success'], True)
+      self.assertEqual(data['total_questions'], first_page['total_questions'])
+      self.assertTrue(all(question['id'] > first_page['next_cursor']
+                          for question in data['questions']))
+
     def test_successful_question_delete(self):
         # create mock question and get id
       mock_question_id = create_mock_question()
@@ -127,6 +153,45 @@ class TriviaTestCase(unittest.TestCase):
       self.assertEqual(data['success'], True)
       self.assertEqual(data['message'], 'Question successfully created!')
 
+    def test_bulk_insert_and_export_questions(self):
+      lines = [
+        json.dumps({'question': 'Bulk mock question', 'answer': 'mock',
+                    'difficulty': 1, 'category': 1}),
+        '{not json',
+        json.dumps({'question': 'Bulk mock question', 'answer': 'mock',
+                    'difficulty': 1, 'category': 1987})
+      ]
+
+        # make request and process response
+      response = self.client().post('/questions/bulk',
+                                    data='\n'.join(lines),
+                                    content_type='application/x-ndjson')
+      data = json.loads(response.data)
+
+        # only the valid row is inserted, the others are reported
+      self.assertEqual(response.status_code, 200)
+      self.assertEqual(data['inserted'], 1)
+      self.assertEqual([error['line'] for error in data['errors']], [2, 3])
+
+      response = self.client().get('/questions/export')
+      exported = [json.loads(line) for line in response.data.splitlines()]
+      self.assertEqual(response.status_code, 200)
+      self.assertEqual(response.mimetype, 'application/x-ndjson')
+      self.assertEqual(exported[-1]['question'], 'Bulk mock question')
+
+    def test_batch_rolls_back_on_error(self):
+      with self.app.app_context():
+        total_before = Question.query.count()
+
+          # nothing inserted in a failed batch is kept
+        with self.assertRaises(RuntimeError):
+          with batch(chunk_size=2):
+            for i in range(3):
+              Question('Batch mock question', 'mock', 1, 1).insert()
+            raise RuntimeError('abort the batch')
+
+        self.assertEqual(Question.query.count(), total_before)
+
     def test_create_question_with_empty_data(self):
       request_data ={
         'question': '',
@@ -142,6 +207,20 @@ class TriviaTestCase(unittest.TestCase):
       self.assertEqual(data['success'], False)
       self.assertEqual(data['message'], 'Unprocessable entity')
 
+    def test_create_question_with_unknown_category(self):
+      request_data = {
+        'question': 'Mock question',
+        'answer': 'Mock answer',
+        'difficulty': 1,
+        'category': 1000,
+      }
+      response = self.client().post('/questions', json=request_data)
+      data = json.loads(response.data)
+
+      self.assertEqual(response.status_code, 422)
+      self.assertEqual(data['success'], False)
+      self.assertEqual(data['message'], 'Unprocessable entity')
+
     def test_search_questions(self):
       request_data ={
         'searchTerm': 'largest lake in Africa',
@@ -156,6 +235,26 @@ class TriviaTestCase(unittest.TestCase):
       self.assertEqual(data['success'], True)
       self.assertEqual(len(data['questions']), 1)
 
+    def test_search_questions_total_counts_matches_only(self):
+      response = self.client().post('/questions/search',
+                                    json={'searchTerm': 'largest lake in Africa'})
+      data = json.loads(response.data)
+
+        # total should be the number of matches, not the whole table
+      self.assertEqual(response.status_code, 200)
+      self.assertEqual(data['total_questions'], 1)
+      self.assertEqual(data['has_next'], False)
+
+    def test_search_questions_matches_answers(self):
+      response = self.client().post('/questions/search',
+                                    json={'searchTerm': 'victoria'})
+      data = json.loads(response.data)
+
+        # 'Lake Victoria' only appears in the answer
+      self.assertEqual(response.status_code, 200)
+      self.assertTrue(any(question['answer'] == 'Lake Victoria'
+                          for question in data['questions']))
+
     def test_empty_search_term_response(self):
       request_data = {
         'searchTerm': '',
@@ -226,6 +325,69 @@ class TriviaTestCase(unittest.TestCase):
         # Ensures returned question is in the correct category
       self.assertEqual(data['question']['category'], 4)
 
+    def test_play_quiz_until_exhausted(self):
+      previous_questions = []
+      quiz_category = {'type': 'History', 'id': 4}
+
+        # keep playing until the server runs out of questions
+      while True:
+        response = self.client().post('/quizzes', json={
+          'previous_questions': previous_questions,
+          'quiz_category': quiz_category
+        })
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        if data['question'] is None:
+          break
+        self.assertNotIn(data['question']['id'], previous_questions)
+        previous_questions.append(data['question']['id'])
+
+      self.assertEqual(data['success'], True)
+      self.assertEqual(data['quiz_exhausted'], True)
+      self.assertTrue(previous_questions)
+
+    def test_play_quiz_with_session(self):
+      response = self.client().post('/quizzes', json={
+        'start_session': True,
+        'quiz_category': {'type': 'History', 'id': 4}
+      })
+      data = json.loads(response.data)
+      self.assertEqual(response.status_code, 200)
+      self.assertTrue(data['quiz_session'])
+
+        # the session remembers the questions already played
+      played = [data['question']['id']]
+      while not data['quiz_exhausted']:
+        response = self.client().post(
+            '/quizzes', json={'quiz_session': data['quiz_session']})
+        data = json.loads(response.data)
+        if data['question']:
+          self.assertNotIn(data['question']['id'], played)
+          played.append(data['question']['id'])
+
+      self.assertEqual(response.status_code, 200)
+      self.assertIsNone(data['question'])
+
+    def test_play_quiz_with_unknown_session(self):
+      response = self.client().post('/quizzes',
+                                    json={'quiz_session': 'not-a-session'})
+      data = json.loads(response.data)
+
+      self.assertEqual(response.status_code, 404)
+      self.assertEqual(data['success'], False)
+
+    def test_quiz_sessions_drop_least_recently_used(self):
+      store = MemoryQuizSessionStore(max_sessions=2)
+      first = store.create([1, 2])
+      second = store.create([3, 4])
+      store.next_question_id(first)
+      third = store.create([5, 6])
+
+      self.assertIn(store.next_question_id(first), [1, 2])
+      self.assertIn(store.next_question_id(third), [5, 6])
+      with self.assertRaises(KeyError):
+        store.next_question_id(second)
+
     def test_no_data_to_play_quiz(self):
       response = self.client().post('/quizzes', json={})
       data = json.loads(response.data)
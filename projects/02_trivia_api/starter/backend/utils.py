@@ -1,3 +1,7 @@
+import random
+
+from sqlalchemy import func
+
 from models import Question
 
 
@@ -11,7 +15,7 @@ def create_mock_question():
         question='This is a test question that should deleted',
         answer='this answer should be deleted',
         difficulty=1,
-        category='1')
+        category=1)
 
     # create a new mock question in the database
     question.insert()
@@ -19,15 +23,60 @@ def create_mock_question():
     # return id of the mock question
     return question.id
 
-# utility for paginating questions
+# utility for paginating queries
 
 
-def get_paginated_questions(request, questions, num_of_questions):
+def paginate_query(request, query, key, num_of_items):
+    """Paginates a SQLAlchemy query inside the database.
+    Only the rows of the requested page are loaded and formatted.
+    The page is picked with ?after_id= (keyset on ``key``) when given,
+    otherwise with ?page= (LIMIT/OFFSET).
+    """
+    after_id = request.args.get('after_id', type=int)
     page = request.args.get('page', 1, type=int)
-    start = (page - 1) * num_of_questions
-    end = start + num_of_questions
 
-    questions = [question.format() for question in questions]
-    current_questions = questions[start:end]
+    # count on the filtered query, without loading any row
+    total = query.order_by(None).with_entities(func.count(key)).scalar()
+
+    query = query.order_by(key)
+    if after_id is not None:
+        query = query.filter(key > after_id)
+    else:
+        query = query.offset((max(page, 1) - 1) * num_of_items)
+
+    # fetch one extra row so we know whether another page follows
+    items = query.limit(num_of_items + 1).all()
+    has_next = len(items) > num_of_items
+    items = items[:num_of_items]
+
+    return {
+        'items': [item.format() for item in items],
+        'total': total,
+        'has_next': has_next,
+        'next_cursor': getattr(items[-1], key.key) if has_next else None
+    }
+
+
+# utility for picking quiz questions
+
+
+def get_random_question(query, key, previous_ids):
+    """Picks a random row of ``query`` whose ``key`` is not in previous_ids.
+    The exclusion happens in the database with NOT IN, and the row is
+    fetched at a random OFFSET into the remaining rows, so the cost does
+    not grow as the quiz goes on. Returns None once every row was used.
+    """
+    if previous_ids:
+        query = query.filter(~key.in_(previous_ids))
 
-    return current_questions
\ No newline at end of file
+    # a row may be deleted between the count and the fetch, so retry
+    for _ in range(3):
+        remaining = query.order_by(None).with_entities(
+            func.count(key)).scalar()
+        if remaining == 0:
+            return None
+        item = query.order_by(key).offset(
+            random.randrange(remaining)).first()
+        if item is not None:
+            return item
+    return None
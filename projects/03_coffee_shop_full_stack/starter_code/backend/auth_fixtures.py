@@ -0,0 +1,61 @@
+'''
+Local signing keys and tokens for the tests and the auth benchmark
+
+make_keypair() generates an RSA keypair and its public JWK,
+write_jwks() stores JWKs as a JWKS file to be used through AUTH0_JWKS_FILE
+and mint_token() signs a token the API accepts, so neither needs Auth0 or
+network access.
+'''
+import base64
+import json
+import time
+
+from Crypto.PublicKey import RSA
+from jose import jwt
+
+
+KID = 'local-key'
+
+
+def b64_uint(value):
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def make_keypair():
+    '''
+    returns the PEM private key and the public JWK of a new RSA keypair
+    '''
+    key = RSA.generate(2048)
+    jwk = {
+        'kty': 'RSA',
+        'kid': KID,
+        'use': 'sig',
+        'alg': 'RS256',
+        'n': b64_uint(key.n),
+        'e': b64_uint(key.e)
+    }
+    return key.export_key('PEM').decode('ascii'), jwk
+
+
+def write_jwks(path, *jwks):
+    with open(path, 'w') as jwks_file:
+        json.dump({'keys': list(jwks)}, jwks_file)
+
+
+def mint_token(private_key, auth, permissions, expires_in=3600, subject=0):
+    '''
+    returns a token for the audience and issuer configured in auth, holding
+    permissions and expiring in expires_in seconds (negative for expired)
+    '''
+    now = int(time.time())
+    claims = {
+        'iss': f'https://{auth.AUTH0_DOMAIN}/',
+        'aud': auth.API_AUDIENCE,
+        'sub': f'auth0|local-{subject}',
+        'iat': now,
+        'exp': now + expires_in,
+        'permissions': permissions
+    }
+    return jwt.encode(claims, private_key, algorithm='RS256',
+                      headers={'kid': KID})
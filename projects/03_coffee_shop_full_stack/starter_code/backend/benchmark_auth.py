@@ -0,0 +1,168 @@
+'''
+Offline benchmark of the auth path of the coffee shop API
+
+    get_token_auth_header -> verify_decode_jwt -> check_permissions
+
+It generates a local RSA keypair, writes its JWKS to a temporary file used
+through AUTH0_JWKS_FILE (no network access is needed), mints tokens with
+varied claims and drives GET /drinks-detail and the write endpoints
+(POST /drinks, PATCH and DELETE /drinks/<id>) through the Flask test client.
+The app runs against a temporary SQLite database, never src/database.
+For every scenario it reports p50/p99 latency and requests per second.
+
+From the backend directory run:
+
+    python benchmark_auth.py --requests 2000
+'''
+import argparse
+import itertools
+import os
+import statistics
+import tempfile
+import time
+
+from auth_fixtures import make_keypair, mint_token, write_jwks
+
+
+def get_drinks_detail(client, headers):
+    return client.get('/drinks-detail', headers=headers)
+
+
+def drink_writes(client):
+    '''
+    returns the POST, PATCH and DELETE request functions of the write
+    scenarios: POST creates drinks with unique titles, PATCH updates them in
+    turn and DELETE removes them. Each scenario sends the same number of
+    requests, so DELETE finds exactly the drinks POST created.
+    '''
+    recipe = [{'name': 'water', 'color': 'blue', 'parts': 1}]
+    titles = itertools.count()
+    created = []
+    updated = itertools.count()
+
+    def post(client, headers):
+        response = client.post('/drinks', headers=headers, json={
+            'title': f'benchmark {next(titles)}', 'recipe': recipe})
+        if response.status_code == 200:
+            created.append(response.get_json()['drinks'][0]['id'])
+        return response
+
+    def patch(client, headers):
+        drink_id = created[next(updated) % len(created)]
+        return client.patch(f'/drinks/{drink_id}', headers=headers,
+                            json={'recipe': recipe})
+
+    def delete(client, headers):
+        return client.delete(f'/drinks/{created.pop()}', headers=headers)
+
+    return post, patch, delete
+
+
+def run(client, tokens, requests, send=get_drinks_detail,
+        before_request=None):
+    '''
+    sends `requests` calls of send(client, headers), GET /drinks-detail by
+    default, cycling through tokens and returns the latencies in seconds and
+    the status codes seen
+    '''
+    latencies = []
+    statuses = {}
+    for i in range(requests):
+        if before_request is not None:
+            before_request()
+        headers = {'Authorization': 'Bearer ' + tokens[i % len(tokens)]}
+        start = time.perf_counter()
+        response = send(client, headers)
+        # read the body to include serializing the response
+        response.get_data()
+        latencies.append(time.perf_counter() - start)
+        response.close()
+        statuses[response.status_code] = \
+            statuses.get(response.status_code, 0) + 1
+    return latencies, statuses
+
+
+def report(name, latencies, statuses):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[min(len(latencies) - 1,
+                        int(len(latencies) * 0.99))] * 1000
+    rps = len(latencies) / sum(latencies)
+    codes = ', '.join(f'{code}x{count}'
+                      for code, count in sorted(statuses.items()))
+    print(f'{name:<22} p50 {p50:8.3f} ms   p99 {p99:8.3f} ms   '
+          f'{rps:9.1f} req/s   [{codes}]')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='requests per scenario')
+    parser.add_argument('--tokens', type=int, default=50,
+                        help='distinct valid tokens to cycle through')
+    args = parser.parse_args()
+
+    private_key, jwk = make_keypair()
+    other_key, _ = make_keypair()
+    tmp = tempfile.TemporaryDirectory()
+    jwks_path = os.path.join(tmp.name, 'jwks.json')
+    write_jwks(jwks_path, jwk)
+    # both must be set before src.api is imported: src.auth builds its JWKS
+    # cache and setup_db creates the tables on import
+    os.environ['AUTH0_JWKS_FILE'] = jwks_path
+    from src.database import models
+    models.database_path = 'sqlite:///' + os.path.join(tmp.name,
+                                                       'benchmark.db')
+
+    from src.api import app
+    from src.auth import auth
+
+    client = app.test_client()
+    # tokens with a growing number of scopes, from 1 to a few hundred
+    valid = [mint_token(private_key, auth,
+                        ['get:drinks-detail'] +
+                        [f'scope:{n}' for n in range(i * 7)],
+                        subject=i)
+             for i in range(args.tokens)]
+    expired = [mint_token(private_key, auth, ['get:drinks-detail'],
+                          expires_in=-60)]
+    bad_signature = [mint_token(other_key, auth, ['get:drinks-detail'])]
+    missing_permission = [mint_token(private_key, auth, ['get:drinks'])]
+    manager = [mint_token(private_key, auth,
+                          ['get:drinks-detail', 'post:drinks',
+                           'patch:drinks', 'delete:drinks'])]
+    post, patch, delete = drink_writes(client)
+
+    def cold():
+        auth.token_cache.clear()
+        auth.jwks_cache.clear()
+
+    try:
+        scenarios = [
+            ('cold (no caches)', valid, get_drinks_detail, cold),
+            ('cold token cache', valid, get_drinks_detail,
+             auth.token_cache.clear),
+            ('warm', valid, get_drinks_detail, None),
+            ('expired token', expired, get_drinks_detail, None),
+            ('invalid signature', bad_signature, get_drinks_detail, None),
+            ('missing permission', missing_permission, get_drinks_detail,
+             None),
+            ('POST /drinks', manager, post, None),
+            ('PATCH /drinks/<id>', manager, patch, None),
+            ('DELETE /drinks/<id>', manager, delete, None)
+        ]
+        for name, tokens, send, before_request in scenarios:
+            # warm up the interpreter and, for the warm run, the caches
+            run(client, tokens, min(len(tokens), args.requests), send)
+            latencies, statuses = run(client, tokens, args.requests, send,
+                                      before_request)
+            report(name, latencies, statuses)
+        print('token cache', auth.token_cache.stats())
+    finally:
+        auth.jwks_cache.stop()
+        models.db.session.remove()
+        tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
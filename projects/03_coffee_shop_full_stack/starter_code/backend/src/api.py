@@ -1,11 +1,18 @@
 import os
-from flask import Flask, request, jsonify, abort
+from flask import Flask, Response, request, jsonify, abort
 from sqlalchemy import exc
-import json
 from flask_cors import CORS
 
-from .database.models import db_drop_and_create_all, setup_db, Drink
-from .auth.auth import AuthError, requires_auth
+from .database.models import db_drop_and_create_all, setup_db, db, batch, Drink
+from .auth.auth import AuthError, requires_auth, permission_set
+from .compression import negotiate_encoding
+from .menu import menu_snapshot
+
+# seconds a shared cache (CDN, reverse proxy) may serve GET /drinks without
+# revalidating it
+DRINKS_MAX_AGE = int(os.environ.get('DRINKS_MAX_AGE', 60))
+# largest list of drinks accepted by the bulk endpoints
+BULK_MAX_DRINKS = int(os.environ.get('BULK_MAX_DRINKS', 1000))
 
 app = Flask(__name__)
 setup_db(app)
@@ -30,11 +37,10 @@ CORS(app)
 
 @app.route('/drinks', methods=['GET'])
 def get_drinks():
-  drinks = Drink.query.all()
-  return jsonify({
-    'success': True,
-    'drinks': [drink.short() for drink in drinks]
-  }), 200
+  response = menu_response('short')
+  response.cache_control.public = True
+  response.cache_control.max_age = DRINKS_MAX_AGE
+  return response
 
 
 
@@ -52,12 +58,27 @@ def get_drinks():
 @app.route('/drinks-detail', methods=['GET'])
 @requires_auth('get:drinks-detail')
 def get_drink_detail(payload):
-  drinks = Drink.query.all()
-
-  return jsonify({
-    'success': True,
-    'drinks': [drink.long() for drink in drinks]
-  })
+  response = menu_response('long')
+  # per user, and revalidated on every use since the token may be revoked
+  response.cache_control.private = True
+  response.cache_control.no_cache = True
+  return response
+
+
+def menu_response(form):
+  '''
+  serves the cached menu snapshot, 304 when the client's copy is current
+  '''
+  encoding = negotiate_encoding()
+  body, etag, last_modified = menu_snapshot.get(form, encoding)
+  response = Response(body, mimetype='application/json')
+  response.set_etag(etag)
+  if last_modified is not None:
+    response.last_modified = last_modified
+  response.headers['Vary'] = 'Accept-Encoding'
+  if encoding:
+    response.headers['Content-Encoding'] = encoding
+  return response.make_conditional(request)
 
 
 '''
@@ -82,7 +103,7 @@ def create_drink(payload):
 
     drink = Drink()
     drink.title = req['title']
-    drink.recipe = json.dumps(req_recipe)  # convert object to a string
+    drink.recipe = req_recipe
     drink.insert()
 
   except BaseException:
@@ -119,7 +140,7 @@ def update_drink(payload, id):
       drink.title = req_title
 
     if req_recipe:
-      drink.recipe = json.dumps(req['recipe'])
+      drink.recipe = req_recipe
 
     drink.update()
   except BaseException:
@@ -128,6 +149,149 @@ def update_drink(payload, id):
   return jsonify({'success': True, 'drinks': [drink.long()]}), 200
 
 
+'''
+POST /drinks/bulk and PATCH /drinks/bulk
+    body {"drinks": [{"title": ..., "recipe": [...]}, ...]}
+    upserts the drinks by title in a single transaction: a drink whose title
+    exists gets the new recipe, any other drink is created.
+    POST requires 'post:drinks' and PATCH 'patch:drinks'; updating an
+    existing drink through POST also needs 'patch:drinks' and creating one
+    through PATCH also needs 'post:drinks'.
+    every drink is validated first, if any of them fails nothing is written
+    and the response is 422 with the per-item results.
+    returns status code 200 and json {"success": True, "results": results}
+    where results holds, in request order, the status ("created" or
+    "updated") and the drink.long() data representation of each drink
+'''
+@app.route('/drinks/bulk', methods=['POST'])
+@requires_auth('post:drinks')
+def create_drinks_bulk(payload):
+  return upsert_drinks(payload)
+
+
+@app.route('/drinks/bulk', methods=['PATCH'])
+@requires_auth('patch:drinks')
+def update_drinks_bulk(payload):
+  return upsert_drinks(payload)
+
+
+def upsert_drinks(payload):
+  req = request.get_json(silent=True)
+  req_drinks = req.get('drinks') if isinstance(req, dict) else None
+  if not isinstance(req_drinks, list) or not req_drinks \
+      or len(req_drinks) > BULK_MAX_DRINKS:
+    abort(400)
+
+  granted = permission_set(payload.get('permissions', []))
+  titles = [req_drink.get('title') if isinstance(req_drink, dict) else None
+            for req_drink in req_drinks]
+  existing = find_drinks_by_title(
+    {title for title in titles if isinstance(title, str)})
+
+  results = []
+  seen = set()
+  for index, req_drink in enumerate(req_drinks):
+    title = titles[index]
+    errors = validate_drink(req_drink)
+    if isinstance(title, str):
+      if title in seen:
+        errors.append('duplicate title in the request')
+      seen.add(title)
+
+    # validate_drink already reported a missing or non string title
+    status = None
+    if isinstance(title, str):
+      status = 'updated' if title in existing else 'created'
+      permission = 'patch:drinks' if status == 'updated' else 'post:drinks'
+      if permission not in granted:
+        errors.append(f'{permission} permission required')
+
+    if errors:
+      results.append({'index': index, 'title': title, 'status': 'error',
+                      'errors': errors})
+    else:
+      results.append({'index': index, 'title': title, 'status': status})
+
+  if any(result['status'] == 'error' for result in results):
+    return jsonify({
+      'success': False,
+      'error': 422,
+      'message': 'unprocessable',
+      'results': results
+    }), 422
+
+  drinks = []
+  try:
+    with batch():
+      for req_drink, result in zip(req_drinks, results):
+        recipe = req_drink['recipe']
+        if isinstance(recipe, dict):
+          recipe = [recipe]
+
+        drink = existing.get(result['title'])
+        if drink is None:
+          drink = Drink(title=result['title'], recipe=recipe)
+          drink.insert()
+        else:
+          drink.recipe = recipe
+          drink.update()
+        drinks.append(drink)
+
+      # assigns the new ids and serializes before the commit expires them
+      db.session.flush()
+      for drink, result in zip(drinks, results):
+        result['drink'] = drink.long()
+  except exc.IntegrityError:
+    # a drink with one of the titles was created concurrently
+    abort(422)
+
+  return jsonify({'success': True, 'results': results}), 200
+
+
+def find_drinks_by_title(titles, chunk_size=500):
+  '''
+  returns {title: drink} of the existing drinks among titles
+  '''
+  titles = sorted(titles)
+  drinks = {}
+  for start in range(0, len(titles), chunk_size):
+    chunk = titles[start:start + chunk_size]
+    for drink in Drink.query.filter(Drink.title.in_(chunk)):
+      drinks[drink.title] = drink
+  return drinks
+
+
+def validate_drink(req_drink):
+  '''
+  returns the list of problems of one drink of a bulk request
+  '''
+  if not isinstance(req_drink, dict):
+    return ['expected an object with a title and a recipe']
+
+  errors = []
+  title = req_drink.get('title')
+  if not isinstance(title, str) or not title.strip():
+    errors.append('title is required')
+  elif len(title) > Drink.title.type.length:
+    errors.append(f'title is longer than {Drink.title.type.length} characters')
+
+  recipe = req_drink.get('recipe')
+  if isinstance(recipe, dict):
+    recipe = [recipe]
+  if not isinstance(recipe, list) or not recipe:
+    errors.append('recipe must be a non empty list of ingredients')
+    return errors
+  for ingredient in recipe:
+    if not isinstance(ingredient, dict) \
+        or not isinstance(ingredient.get('name'), str) \
+        or not isinstance(ingredient.get('color'), str) \
+        or isinstance(ingredient.get('parts'), bool) \
+        or not isinstance(ingredient.get('parts'), (int, float)):
+      errors.append('every ingredient needs a name, a color and parts')
+      break
+  return errors
+
+
 '''
 @TODO implement endpoint
     DELETE /drinks/<id>
@@ -1,15 +1,35 @@
 
-import json
+import os
+from collections import namedtuple
 from flask import request, _request_ctx_stack, abort
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+
+from .jwks import JWKSCache, JWKSError
+from .token_cache import TokenCache
 
 
 AUTH0_DOMAIN = 'coffee-api-server.us.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'http://localhost:5000/'
 
+'''
+signing keys of AUTH0_DOMAIN, cached by kid and refreshed in the background
+set AUTH0_JWKS_FILE to the path of a JWKS file to use local keys instead
+'''
+jwks_cache = JWKSCache(
+  url=f'https://{AUTH0_DOMAIN}/.well-known/jwks.json',
+  path=os.environ.get('AUTH0_JWKS_FILE'),
+  background_refresh=True)
+
+'''
+verified tokens, so repeated tokens skip the RS256 check
+entries live until the token's exp or TOKEN_CACHE_MAX_AGE seconds
+'''
+TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_MAX_AGE = int(os.environ.get('AUTH_TOKEN_CACHE_MAX_AGE', 300))
+token_cache = TokenCache(max_size=TOKEN_CACHE_SIZE,
+                         max_age=TOKEN_CACHE_MAX_AGE)
 
 
 
@@ -63,19 +83,45 @@ def get_token_auth_header():
 '''
 @TODO implement check_permissions(permission, payload) method
     @INPUTS
-        permission: string permission (i.e. 'post:drink')
+        permission: string permission (i.e. 'post:drink') or an iterable of them
         payload: decoded jwt payload
+        match: 'all' to require every permission, 'any' for at least one
 
     it should raise an AuthError if permissions are not included in the payload
         !!NOTE check your RBAC settings in Auth0
     it should raise an AuthError if the requested permission string is not in the payload permissions array
     return true otherwise
 '''
-def check_permissions(permission, payload):
+def check_permissions(permission, payload, match='all'):
   if 'permissions' not in payload:
     abort(400)
 
-  if permission not in payload['permissions']:
+  return check_permission_set(
+    permission_set(permission), frozenset(payload['permissions']), match)
+
+'''
+permission_set(permissions)
+    a permission string or an iterable of them as a frozenset
+'''
+def permission_set(permissions):
+  if isinstance(permissions, str):
+    permissions = [permissions]
+  return frozenset(permissions)
+
+'''
+check_permission_set(required, granted, match)
+    raises an AuthError unless granted holds all (match='all') or at least
+    one (match='any') of the required permissions, using set operations
+'''
+def check_permission_set(required, granted, match='all'):
+  if match == 'all':
+    allowed = required <= granted
+  elif match == 'any':
+    allowed = not required or not required.isdisjoint(granted)
+  else:
+    raise ValueError(f'Unknown permission match: {match}')
+
+  if not allowed:
     raise AuthError({
       'code': 'unauthorized',
       'description': 'Permission Not found',
@@ -96,9 +142,28 @@ def check_permissions(permission, payload):
     !!NOTE urlopen has a common certificate error described here: https://stackoverflow.com/questions/50236117/scraping-ssl-certificate-verify-failed-error-for-http-en-wikipedia-org
 '''
 def verify_decode_jwt(token):
-  jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-  jwks = json.loads(jsonurl.read())
+  return verify_token(token).payload
+
+'''
+VerifiedToken
+    the decoded payload of a verified token, with its permissions as a
+    frozenset computed once and cached alongside it
+'''
+VerifiedToken = namedtuple('VerifiedToken', ['payload', 'permissions'])
 
+def verify_token(token):
+    # a token verified recently does not need another signature check
+  verified = token_cache.get(token)
+  if verified is not None:
+    return verified
+
+  payload = decode_jwt(token)
+  verified = VerifiedToken(payload,
+                           frozenset(payload.get('permissions') or ()))
+  token_cache.put(token, verified, payload.get('exp'))
+  return verified
+
+def decode_jwt(token):
     # Get the data in the header
   unverified_header = jwt.get_unverified_header(token)
 
@@ -109,18 +174,13 @@ def verify_decode_jwt(token):
       'description': 'Authorization malformed'
     }, 401)
 
-  rsa_key = {}
-
-  for key in jwks['keys']:
-    if key['kid'] == unverified_header['kid']:
-      rsa_key = {
-        'kty': key['kty'],
-        'kid': key['kid'],
-        'use': key['use'],
-        'n': key['n'],
-        'e': key['e']
-      }
-      break
+  try:
+    rsa_key = jwks_cache.get_key(unverified_header['kid'])
+  except JWKSError:
+    raise AuthError({
+      'code': 'jwks_unavailable',
+      'description': 'Unable to load the signing keys.'
+    }, 503)
 
     # verify the token
   if rsa_key:
@@ -166,21 +226,30 @@ def verify_decode_jwt(token):
 '''
 @TODO implement @requires_auth(permission) decorator method
     @INPUTS
-        permission: string permission (i.e. 'post:drink')
+        permissions: string permissions (i.e. 'post:drink'), none to only
+            require a valid token
+        match: 'all' to require every permission, 'any' for at least one
 
     it should use the get_token_auth_header method to get the token
     it should use the verify_decode_jwt method to decode the jwt
     it should use the check_permissions method validate claims and check the requested permission
     return the decorator which passes the decoded payload to the decorated method
 '''
-def requires_auth(permission=''):
+def requires_auth(*permissions, match='all'):
+    required = frozenset(permission for permission in permissions
+                         if permission)
+    if match not in ('all', 'any'):
+        raise ValueError(f'Unknown permission match: {match}')
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
-            return f(payload, *args, **kwargs)
+            verified = verify_token(token)
+            if 'permissions' not in verified.payload:
+                abort(400)
+            check_permission_set(required, verified.permissions, match)
+            return f(verified.payload, *args, **kwargs)
 
         return wrapper
-    return requires_auth_decorator
\ No newline at end of file
+    return requires_auth_decorator
@@ -0,0 +1,160 @@
+import json
+import logging
+import re
+import threading
+import time
+from urllib.request import urlopen
+
+
+logger = logging.getLogger(__name__)
+
+MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+
+
+'''
+JWKSError Exception
+raised when no signing keys can be loaded at all
+'''
+class JWKSError(Exception):
+    pass
+
+
+'''
+JWKSCache
+    caches the signing keys of a JWKS document, keyed by kid
+
+    the keys come from `url` (the Auth0 /.well-known/jwks.json) or, when
+    `path` is set, from a local JWKS file so tests and air-gapped
+    deployments work offline.
+    keys are kept for the max-age of the Cache-Control response header
+    (default_ttl when there is none). With background_refresh a daemon
+    thread reloads them shortly before they expire, so requests never wait
+    on the network. An unknown kid triggers one refetch for all waiting
+    requests (single flight), at most once every min_refetch_interval
+    seconds, which picks up rotated keys without letting bogus kids hammer
+    the JWKS endpoint.
+    if a refresh fails the previous keys are kept.
+'''
+class JWKSCache(object):
+
+    def __init__(self, url=None, path=None, default_ttl=600,
+                 min_refetch_interval=30, background_refresh=False,
+                 refresh_margin=60):
+        self.url = url
+        self.path = path
+        self.default_ttl = default_ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.background_refresh = background_refresh
+        self.refresh_margin = refresh_margin
+        self._keys = {}
+        self._expires_at = 0
+        self._fetched_at = 0
+        self._fetch_lock = threading.Lock()
+        self._refresher = None
+        self._stop = threading.Event()
+
+    def get_key(self, kid):
+        '''
+        returns the RSA key dict for kid, or None if the JWKS has no such key
+        '''
+        if self.background_refresh:
+            self._start_refresher()
+
+        keys = self._keys
+        if keys and self._expires_at > time.time():
+            if kid in keys:
+                return keys[kid]
+            # unknown kid, the keys may have been rotated
+            if time.time() - self._fetched_at < self.min_refetch_interval:
+                return None
+
+        self.refresh(seen_fetched_at=self._fetched_at)
+        return self._keys.get(kid)
+
+    def refresh(self, seen_fetched_at=None):
+        '''
+        reloads the keys; callers that waited on another thread's reload
+        return as soon as it is done instead of fetching again
+        '''
+        with self._fetch_lock:
+            if seen_fetched_at is not None and \
+                    self._fetched_at != seen_fetched_at:
+                return
+            try:
+                jwks, ttl = self._fetch()
+            except Exception:
+                if not self._keys:
+                    raise JWKSError('Unable to load the JWKS')
+                logger.exception('JWKS refresh failed, keeping the old keys')
+                # retry soon, but not on every request
+                self._fetched_at = time.time()
+                self._expires_at = self._fetched_at + self.min_refetch_interval
+                return
+
+            keys = {}
+            for key in jwks.get('keys', []):
+                if 'kid' not in key:
+                    continue
+                keys[key['kid']] = {
+                    'kty': key.get('kty'),
+                    'kid': key['kid'],
+                    'use': key.get('use'),
+                    'n': key.get('n'),
+                    'e': key.get('e')
+                }
+            self._keys = keys
+            self._fetched_at = time.time()
+            self._expires_at = self._fetched_at + ttl
+
+    def clear(self):
+        with self._fetch_lock:
+            self._keys = {}
+            self._expires_at = 0
+            self._fetched_at = 0
+
+    def stop(self):
+        self._stop.set()
+
+    def _fetch(self):
+        if self.path:
+            with open(self.path) as jwks_file:
+                return json.load(jwks_file), self.default_ttl
+
+        response = urlopen(self.url, timeout=10)
+        try:
+            jwks = json.loads(response.read())
+            cache_control = response.headers.get('Cache-Control') or ''
+        finally:
+            response.close()
+
+        ttl = self.default_ttl
+        match = MAX_AGE_PATTERN.search(cache_control)
+        if 'no-store' in cache_control or 'no-cache' in cache_control:
+            ttl = self.min_refetch_interval
+        elif match:
+            ttl = max(int(match.group(1)), self.min_refetch_interval)
+        return jwks, ttl
+
+    def _start_refresher(self):
+        if self._refresher is not None:
+            return
+        with self._fetch_lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(
+                target=self._refresh_loop, name='jwks-refresh', daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            margin = min(self.refresh_margin,
+                         (self._expires_at - self._fetched_at) / 2)
+            delay = self._expires_at - margin - time.time()
+            if delay > 0:
+                self._stop.wait(min(delay, self.default_ttl))
+                continue
+            try:
+                self.refresh(seen_fetched_at=self._fetched_at)
+            except JWKSError:
+                logger.exception('JWKS refresh failed')
+                self._stop.wait(self.min_refetch_interval)
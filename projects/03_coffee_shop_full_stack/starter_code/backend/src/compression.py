@@ -0,0 +1,37 @@
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+'''
+Response compression
+
+negotiate_encoding() picks brotli or gzip from the Accept-Encoding of the
+request and encode_body() compresses a complete response body with it.
+brotli is optional: without the package only gzip is offered.
+'''
+
+
+def negotiate_encoding():
+    """Picks br or gzip from Accept-Encoding, None for identity."""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def encode_body(data, encoding):
+    """Compresses a complete body with encoding (br, gzip or None)."""
+    if encoding == 'br':
+        return brotli.compress(data)
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+    return data
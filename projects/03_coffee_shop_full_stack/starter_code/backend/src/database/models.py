@@ -1,5 +1,9 @@
 import os
-from sqlalchemy import Column, String, Integer
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import Column, String, Integer, JSON, DateTime, event
+from sqlalchemy.orm import Session
 from flask_sqlalchemy import SQLAlchemy
 import json
 
@@ -18,6 +22,8 @@ def setup_db(app):
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.app = app
     db.init_app(app)
+    # only creates missing tables, e.g. drinks_version on an existing database
+    db.create_all()
 
 '''
 db_drop_and_create_all()
@@ -29,6 +35,106 @@ def db_drop_and_create_all():
     db.drop_all()
     db.create_all()
 
+'''
+batch(chunk_size=500)
+    unit of work for the model insert/update/delete helpers
+    inside the block the helpers do not commit: pending changes are flushed
+    every chunk_size operations and committed once when the block exits,
+    or rolled back if it raises. Nested blocks join the outer one.
+    !!NOTE new rows only get their id when the batch is flushed
+    EXAMPLE
+        with batch():
+            for req_drink in req_drinks:
+                Drink(title=req_drink['title'], recipe=req_drink['recipe']).insert()
+'''
+_unit_of_work = threading.local()
+
+@contextmanager
+def batch(chunk_size=500):
+    if getattr(_unit_of_work, 'pending', None) is not None:
+        yield
+        return
+
+    _unit_of_work.pending = 0
+    _unit_of_work.chunk_size = chunk_size
+    try:
+        yield
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+    finally:
+        _unit_of_work.pending = None
+
+'''
+commit()
+    commits the session now, or joins the current batch() if there is one
+'''
+def commit():
+    if getattr(_unit_of_work, 'pending', None) is None:
+        db.session.commit()
+        return
+    _unit_of_work.pending += 1
+    if _unit_of_work.pending >= _unit_of_work.chunk_size:
+        db.session.flush()
+        _unit_of_work.pending = 0
+
+'''
+DrinksVersion
+    single row counter of the drinks table, bumped once by every transaction
+    that changes drinks through Drink.insert/update/delete. It drives the
+    ETag and Last-Modified headers of the menu endpoints, and lets every
+    process notice changes made by the others.
+'''
+class DrinksVersion(db.Model):
+    __tablename__ = 'drinks_version'
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+'''
+get_drinks_version()
+    returns (version, updated_at) of the drinks table, (0, None) before the
+    first change
+'''
+def get_drinks_version():
+    row = db.session.query(DrinksVersion.version, DrinksVersion.updated_at) \
+        .filter(DrinksVersion.id == 1).one_or_none()
+    if row is None:
+        return 0, None
+    return row.version, row.updated_at
+
+'''
+bump_drinks_version()
+    marks the current transaction as changing the drinks table, the version
+    is incremented once when it commits
+'''
+def bump_drinks_version():
+    db.session.info['drinks_changed'] = True
+
+@event.listens_for(Session, 'before_commit')
+def increment_drinks_version(session):
+    if not session.info.pop('drinks_changed', False):
+        return
+    now = datetime.utcnow()
+    table = DrinksVersion.__table__
+    updated = session.execute(
+        table.update()
+        .where(table.c.id == 1)
+        .values(version=table.c.version + 1, updated_at=now)).rowcount
+    if not updated:
+        session.execute(table.insert().values(id=1, version=1, updated_at=now))
+    # the row stays locked until commit, so version - 1 is the version this
+    # transaction started from
+    version = session.execute(
+        db.select([table.c.version]).where(table.c.id == 1)).scalar()
+    session.info['drinks_version'] = (version - 1, version, now)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_drinks_version(session, previous_transaction):
+    session.info.pop('drinks_changed', None)
+    session.info.pop('drinks_version', None)
+
 '''
 Drink
 a persistent drink entity, extends the base SQLAlchemy Model
@@ -38,17 +144,17 @@ class Drink(db.Model):
     id = Column(Integer().with_variant(Integer, "sqlite"), primary_key=True)
     # String Title
     title = Column(String(80), unique=True)
-    # the ingredients blob - this stores a lazy json blob
+    # the ingredients - stored as JSON and decoded once when the row is loaded
     # the required datatype is [{'color': string, 'name':string, 'parts':number}]
-    recipe =  Column(String(180), nullable=False)
+    # rows written by the old String column hold the same JSON text
+    recipe =  Column(JSON, nullable=False)
 
     '''
     short()
         short form representation of the Drink model
     '''
     def short(self):
-        print(json.loads(self.recipe))
-        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in json.loads(self.recipe)]
+        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in self.recipe]
         return {
             'id': self.id,
             'title': self.title,
@@ -63,7 +169,7 @@ class Drink(db.Model):
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': json.loads(self.recipe)
+            'recipe': self.recipe
         }
 
     '''
@@ -77,7 +183,8 @@ class Drink(db.Model):
     '''
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        bump_drinks_version()
+        commit()
 
     '''
     delete()
@@ -89,7 +196,8 @@ class Drink(db.Model):
     '''
     def delete(self):
         db.session.delete(self)
-        db.session.commit()
+        bump_drinks_version()
+        commit()
 
     '''
     update()
@@ -101,7 +209,8 @@ class Drink(db.Model):
             drink.update()
     '''
     def update(self):
-        db.session.commit()
+        bump_drinks_version()
+        commit()
 
     def __repr__(self):
         return json.dumps(self.short())
\ No newline at end of file
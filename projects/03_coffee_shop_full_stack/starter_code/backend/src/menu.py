@@ -0,0 +1,150 @@
+import json
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .database.models import Drink, get_drinks_version
+from .compression import encode_body
+
+
+'''
+MenuSnapshot
+    pre-serialized bodies of GET /drinks (short form) and GET /drinks-detail
+    (long form)
+
+    every drink is serialized once, when it is loaded or changed, and kept
+    as bytes. The response body is the join of those bytes and is only
+    rebuilt after a drink changes, so serving the menu is a copy of cached
+    bytes with a strong ETag. Compressed variants are built on first use.
+    the snapshot follows the drinks version counter: changes committed by
+    this process are applied in place (see the session listeners below),
+    a version bumped by another process reloads the whole table.
+'''
+class MenuSnapshot(object):
+
+    FORMS = {
+        'short': Drink.short,
+        'long': Drink.long
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.version = None
+        self.last_modified = None
+        self._drinks = {form: {} for form in self.FORMS}
+        self._bodies = {}
+
+    def get(self, form, encoding=None):
+        '''
+        returns (body, etag, last_modified) of the menu in the given form and
+        encoding
+        '''
+        version, last_modified = get_drinks_version()
+        with self._lock:
+            if not self.loaded or self.version != version:
+                self._load(version, last_modified)
+            body, etag = self._body(form, encoding)
+            return body, etag, self.last_modified
+
+    def apply(self, changes, base_version, version, last_modified):
+        '''
+        applies the drinks changed by a transaction that moved the drinks
+        version from base_version to version, changes is {id: {form: bytes}}
+        with None for deleted drinks
+        '''
+        with self._lock:
+            if not self.loaded:
+                return
+            if self.version != base_version:
+                # another process changed drinks in between
+                self.loaded = False
+                return
+            for drink_id, serialized in changes.items():
+                for form, drinks in self._drinks.items():
+                    if serialized is None:
+                        drinks.pop(drink_id, None)
+                    else:
+                        drinks[drink_id] = serialized[form]
+            self.version = version
+            self.last_modified = last_modified
+            self._bodies = {}
+
+    def invalidate(self):
+        '''
+        drops everything, the next get() reloads the drinks table
+        '''
+        with self._lock:
+            self.loaded = False
+            self._bodies = {}
+
+    def _load(self, version, last_modified):
+        drinks = {form: {} for form in self.FORMS}
+        for drink in Drink.query.yield_per(500):
+            for form, data in serialize_drink(drink).items():
+                drinks[form][drink.id] = data
+        self._drinks = drinks
+        self._bodies = {}
+        self.version = version
+        self.last_modified = last_modified
+        self.loaded = True
+
+    def _body(self, form, encoding):
+        key = (form, encoding)
+        if key in self._bodies:
+            return self._bodies[key]
+        if encoding is None:
+            drinks = self._drinks[form]
+            body = b''.join([
+                b'{"success": true, "drinks": [',
+                b', '.join(drinks[drink_id] for drink_id in sorted(drinks)),
+                b']}'
+            ])
+            etag = f'drinks-{self.version}-{form}'
+        else:
+            # each encoding is a different representation, its own strong tag
+            body, etag = self._body(form, None)
+            body, etag = encode_body(body, encoding), f'{etag}-{encoding}'
+        self._bodies[key] = (body, etag)
+        return body, etag
+
+
+def serialize_drink(drink):
+    return {form: json.dumps(serialize(drink)).encode('utf-8')
+            for form, serialize in MenuSnapshot.FORMS.items()}
+
+
+menu_snapshot = MenuSnapshot()
+
+
+# serialize changed drinks at flush time, while their state is loaded,
+# and only publish them to the snapshot once the transaction commits.
+# changes are recorded even while the snapshot is not loaded: it may be
+# loaded by another request between this flush and the commit
+@event.listens_for(Session, 'after_flush')
+def record_drink_changes(session, flush_context):
+    changes = session.info.setdefault('menu_changes', {})
+    for drink in session.new | session.dirty:
+        if isinstance(drink, Drink):
+            changes[drink.id] = serialize_drink(drink)
+    for drink in session.deleted:
+        if isinstance(drink, Drink):
+            changes[drink.id] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_drink_changes(session):
+    changes = session.info.pop('menu_changes', None)
+    version = session.info.pop('drinks_version', None)
+    if version is None:
+        # drinks written without the model helpers do not bump the version
+        if changes:
+            menu_snapshot.invalidate()
+        return
+    menu_snapshot.apply(changes or {}, *version)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_drink_changes(session, previous_transaction):
+    session.info.pop('menu_changes', None)
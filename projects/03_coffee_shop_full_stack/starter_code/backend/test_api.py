@@ -0,0 +1,69 @@
+import json
+import os
+import tempfile
+import unittest
+
+from auth_fixtures import make_keypair, mint_token, write_jwks
+
+
+class DrinksBulkTestCase(unittest.TestCase):
+    """This class represents the bulk drinks endpoints test case"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.private_key, jwk = make_keypair()
+        jwks_path = os.path.join(cls.tmp.name, 'jwks.json')
+        write_jwks(jwks_path, jwk)
+        # both must be set before src.api is imported
+        os.environ['AUTH0_JWKS_FILE'] = jwks_path
+        from src.database import models
+        models.database_path = 'sqlite:///' + os.path.join(cls.tmp.name, 'test.db')
+
+        from src.api import app
+        from src.auth import auth
+        from src.database.models import db_drop_and_create_all
+        cls.app = app
+        cls.auth = auth
+        with app.app_context():
+            db_drop_and_create_all()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.auth.jwks_cache.stop()
+        cls.tmp.cleanup()
+
+    def headers(self, *permissions):
+        token = mint_token(self.private_key, self.auth, list(permissions))
+        return {'Authorization': 'Bearer ' + token}
+
+    def test_bulk_create_drinks(self):
+        recipe = [{'name': 'milk', 'color': 'white', 'parts': 1}]
+        response = self.app.test_client().post(
+            '/drinks/bulk', headers=self.headers('post:drinks'),
+            json={'drinks': [{'title': 'bulk latte', 'recipe': recipe}]})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['results'][0]['status'], 'created')
+        self.assertEqual(data['results'][0]['drink']['recipe'], recipe)
+
+    def test_bulk_drinks_with_non_string_title(self):
+        recipe = [{'name': 'milk', 'color': 'white', 'parts': 1}]
+        response = self.app.test_client().post(
+            '/drinks/bulk', headers=self.headers('post:drinks'),
+            json={'drinks': [{'title': ['x'], 'recipe': recipe},
+                             {'title': 'bulk mocha', 'recipe': recipe}]})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['results'][0]['status'], 'error')
+        self.assertEqual(data['results'][0]['errors'], ['title is required'])
+        self.assertEqual(data['results'][1]['status'], 'created')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()